@@ -0,0 +1,48 @@
+"""AST memory benchmark.
+
+Parses and validates generated files (see parser_bench.py) under
+tracemalloc and reports the bytes allocated per syntax tree node. Tokens
+are produced before tracing starts, so only the tree itself is counted.
+"""
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from tokenizer import Tokenizer
+from parser import Parser
+from tree import Tree, Context
+from parser_bench import make_input
+
+FUNCTIONS = [1000, 10000]
+
+
+def count_nodes(node):
+    n, stack = 0, [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Tree):
+            n += 1
+            stack.extend(getattr(node, f) for f in node._fields)
+        elif isinstance(node, list):
+            stack.extend(node)
+    return n
+
+
+def main():
+    T = Tokenizer()
+    print("{:>10} {:>10} {:>12} {:>12}".format('functions', 'nodes', 'bytes', 'bytes/node'))
+    for n in FUNCTIONS:
+        tokens = T.tokenize(make_input(n))
+        tracemalloc.start()
+        tree = Parser().parse(tokens)
+        tree.validate(Context(0, None, None, {}, {}))
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        nodes = count_nodes(tree)
+        print("{:>10} {:>10} {:>12} {:>12.1f}".format(n, nodes, size, size / nodes))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Function call benchmark.
+
+Times call-heavy recursive programs: naive fibonacci, and newton_sqrt_rec.c
+from test_files/ repeated, with the closure engine and the tree walker.
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from tokenizer import Tokenizer
+from parser import Parser
+from tree import Context
+
+FIB = """
+int fib(int n) {
+    if (n < 2) {
+        return n;
+    }
+    return fib(n - 1) + fib(n - 2);
+}
+
+int main() {
+    return fib(%d);
+}
+"""
+
+NEWTON = open(os.path.join(ROOT, 'test_files', 'newton_sqrt_rec.c')).read()
+NEWTON = NEWTON.replace('int main()', 'int newton_main()') + """
+int main() {
+    int i = 0;
+    while (i < %d) {
+        newton_main();
+        i++;
+    }
+    return 0;
+}
+"""
+
+PROGRAMS = [('fib(20)', FIB % 20), ('newton_sqrt_rec x200', NEWTON % 200)]
+REPEAT = 3
+
+
+def load(code):
+    tree = Parser().parse(Tokenizer().tokenize(code))
+    tree.validate(Context(0, None, None, {}, {}))
+    return tree
+
+
+def best_of(f):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    print("{:<22} {:>12} {:>12}".format('program', 'closure (s)', 'tree (s)'))
+    for name, code in PROGRAMS:
+        tree = load(code)
+        run = tree.compile()
+        closure = best_of(lambda: run(Context(0, None, None, {}, {})))
+        walk = best_of(lambda: tree.evaluate(Context(0, None, None, {}, {})))
+        print("{:<22} {:>12.3f} {:>12.3f}".format(name, closure, walk))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Incremental front end benchmark.
+
+Builds a program of about 50k lines, then times a full tokenize, parse and
+validate against edits applied through incremental.Incremental: one inside
+a function body, and one changing a function's signature, which also
+validates its caller again (and makes it fail: it passes too few
+arguments).
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import frontend
+from incremental import Incremental
+from exceptions import ValidationException
+
+FUNCTION = """int f%(i)d(int x, int n) {
+    int i = 0;
+    int a[] = {1, 2, 3, 4};
+    while (i < n) {
+        if (x %% 2 == 0) {
+            x = x / 2 + a[i %% 4];
+        } else {
+            x = 3 * x + 1;
+        }
+        i++;
+    }
+    return x + f%(j)d(x, 0);
+}
+"""
+
+
+def program(n):
+    parts = ["int f0(int x, int n) {\n    return x;\n}\n"]
+    parts += [FUNCTION % {'i': i, 'j': i - 1} for i in range(1, n)]
+    parts.append("int main() {\n    return f%d(7, 10);\n}\n" % (n - 1))
+    return ''.join(parts)
+
+
+def timed(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def main():
+    code = program(3850)
+    print("{} lines".format(code.count('\n')))
+    print("{:<28} {:>10.1f} ms".format(
+        'full front end', 1000 * timed(lambda: frontend.parse(code))))
+    inc = Incremental(code)
+    body = code.index('x = 3 * x + 1;', len(code) // 2)
+    inc.stats.clear()
+    t = timed(lambda: inc.edit(body, body + 14, 'x = 5 * x + 1;'))
+    print("{:<28} {:>10.1f} ms   {}".format('edit a function body', 1000 * t, inc))
+    head = inc.code.index('int f2000(int x, int n)') + len('int f2000(int x, int n')
+    inc.stats.clear()
+    start = time.perf_counter()
+    try:
+        inc.edit(head, head, ', int m')
+    except ValidationException as e:
+        error = type(e).__name__
+    t = time.perf_counter() - start
+    print("{:<28} {:>10.1f} ms   {} ({})".format('change a signature', 1000 * t, inc, error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Parser scaling benchmark.
+
+Parses generated files of 10k, 30k and 100k small functions. Time per
+token should stay flat as the file grows.
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from tokenizer import Tokenizer
+from parser import Parser
+
+FUNCTIONS = [10000, 30000, 100000]
+
+TEMPLATE = """// function {0}
+int f{0}(int a, int b) {{
+    int c = a * {0} + b;
+    while (c > 0) {{
+        c -= (a + 1) * 3;
+    }}
+    if (c == -{0})
+        return c;
+    return f{0}(c, b - 1);
+}}
+"""
+
+
+def make_input(n):
+    return ''.join(TEMPLATE.format(i) for i in range(n))
+
+
+def main():
+    T = Tokenizer()
+    print("{:>10} {:>10} {:>10} {:>12}".format('functions', 'tokens', 'seconds', 'us/token'))
+    for n in FUNCTIONS:
+        tokens = T.tokenize(make_input(n))
+        start = time.perf_counter()
+        tree = Parser().parse(tokens)
+        elapsed = time.perf_counter() - start
+        assert len(tree.functions) == n
+        print("{:>10} {:>10} {:>10.3f} {:>12.2f}".format(
+            n, len(tokens), elapsed, elapsed * 1e6 / len(tokens)))
+
+if __name__ == '__main__':
+    main()
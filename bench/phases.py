@@ -0,0 +1,195 @@
+"""Phase benchmark suite.
+
+Times Tokenizer.tokenize, Parser.parse, Root.validate, Tree.to_str and
+Root.evaluate separately on small, medium and large generated programs,
+and reports tokens/s, nodes/s and the peak tracemalloc memory of each
+phase. With --seed the programs come from src/generator.py instead of a
+fixed template.
+
+    python bench/phases.py run [-o results.json] [--sizes small medium] [--seed 0]
+    python bench/phases.py compare baseline.json results.json [--threshold 10]
+
+compare exits with status 1 when a phase got slower, or its peak memory
+grew, by more than threshold percent.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from tokenizer import Tokenizer
+from parser import Parser
+from tree import Context
+from optimizer import walk
+from generator import Generator
+
+SIZES = {'small': 10, 'medium': 300, 'large': 3000}
+
+TEMPLATE = """// function {0}
+int f{0}(int a, int b) {{
+    int c = a * {0} + b;
+    int i = 0;
+    bool seen[4];
+    while (i < 8) {{
+        c -= (a + 1) * 3;
+        if (c % 2 == 0 && !seen[i % 4]) {{
+            seen[i % 4] = true;
+        }} else {{
+            c = c / 2 + i;
+        }}
+        i++;
+    }}
+    return c;
+}}
+"""
+
+
+def make_input(n, seed=None):
+    if seed is not None:
+        # no printf, the evaluate phase would time the terminal
+        return Generator(seed, printf=0).program(n)
+    calls = ''.join('    total += f{0}({0}, 7);\n'.format(i) for i in range(n))
+    return ''.join(TEMPLATE.format(i) for i in range(n)) + \
+        'int main() {\n    int total = 0;\n' + calls + '    return total;\n}\n'
+
+
+def new_context():
+    return Context(0, None, None, {}, {})
+
+
+def phases(code):
+    """ (name, setup, run) for every phase, setup builds the input run
+    needs outside of the timing """
+    tokens = Tokenizer().tokenize(code)
+
+    def validated():
+        tree = Parser().parse(tokens)
+        tree.validate(new_context())
+        return tree
+
+    return [
+        ('tokenize', lambda: code, Tokenizer().tokenize),
+        ('parse', lambda: tokens, Parser().parse),
+        ('validate', lambda: Parser().parse(tokens), lambda tree: tree.validate(new_context())),
+        ('to_str', validated, lambda tree: tree.to_str()),
+        ('evaluate', validated, lambda tree: tree.evaluate(new_context())),
+    ]
+
+
+def measure(setup, run, repeat, min_time=0.5):
+    # at least repeat runs, and more for fast phases so the best one is
+    # less noisy
+    best, total, runs = None, 0, 0
+    while runs < repeat or total < min_time:
+        value = setup()
+        start = time.perf_counter()
+        run(value)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        total += elapsed
+        runs += 1
+    # a separate run, tracemalloc slows everything down
+    value = setup()
+    tracemalloc.start()
+    run(value)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def run_suite(repeat, sizes=SIZES, seed=None):
+    results = {}
+    for size in sizes:
+        n = SIZES[size]
+        code = make_input(n, seed)
+        n_tokens = len(Tokenizer().tokenize(code))
+        n_nodes = sum(1 for _ in walk(Parser().parse(Tokenizer().tokenize(code))))
+        entry = {'functions': n, 'tokens': n_tokens, 'nodes': n_nodes, 'phases': {}}
+        for name, setup, run in phases(code):
+            seconds, peak = measure(setup, run, repeat if n < 1000 else max(1, repeat // 2))
+            entry['phases'][name] = {
+                'seconds': seconds,
+                'tokens_per_sec': n_tokens / seconds,
+                'nodes_per_sec': n_nodes / seconds,
+                'peak_bytes': peak
+            }
+            print("{:<7} {:<9} {:>10.2f} ms {:>12.0f} tokens/s {:>12.0f} nodes/s {:>10.1f} KiB".format(
+                size, name, seconds * 1000, n_tokens / seconds, n_nodes / seconds, peak / 1024),
+                file=sys.stderr)
+        results[size] = entry
+    return {'python': platform.python_version(), 'repeat': repeat, 'seed': seed,
+        'results': results}
+
+
+def compare(baseline, current, threshold):
+    """ Print every phase's change against the baseline, and return the
+    regressions """
+    regressions = []
+    print("{:<7} {:<9} {:>12} {:>12} {:>8} {:>8}".format(
+        'size', 'phase', 'base ms', 'ms', 'time', 'memory'))
+    for size, entry in current['results'].items():
+        base = baseline['results'].get(size)
+        if base is None:
+            continue
+        for name, now in entry['phases'].items():
+            before = base['phases'].get(name)
+            if before is None:
+                continue
+            d_time = (now['seconds'] / before['seconds'] - 1) * 100
+            d_mem = (now['peak_bytes'] / max(before['peak_bytes'], 1) - 1) * 100
+            flag = ''
+            if d_time > threshold or d_mem > threshold:
+                flag = '  REGRESSION'
+                regressions.append((size, name))
+            print("{:<7} {:<9} {:>12.2f} {:>12.2f} {:>+7.1f}% {:>+7.1f}%{}".format(
+                size, name, before['seconds'] * 1000, now['seconds'] * 1000, d_time, d_mem, flag))
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark the compiler phases')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='run the suite and write JSON results')
+    run.add_argument('-o', '--output', help='write results here instead of stdout')
+    run.add_argument('--repeat', type=int, default=5,
+        help='runs per phase, the best one counts (default: %(default)s)')
+    run.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES),
+        help='inputs to run (default: all)')
+    run.add_argument('--seed', type=int, default=None,
+        help='benchmark programs from the generator with this seed')
+    cmp = commands.add_parser('compare', help='flag regressions against a baseline')
+    cmp.add_argument('baseline')
+    cmp.add_argument('current')
+    cmp.add_argument('--threshold', type=float, default=10,
+        help='percent slowdown or memory growth that counts as a regression (default: %(default)s)')
+    args = arg_parser.parse_args()
+
+    if args.command == 'run':
+        results = run_suite(args.repeat, args.sizes, args.seed)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+                f.write('\n')
+        else:
+            json.dump(results, sys.stdout, indent=2)
+            print()
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print("{} regressions above {}%".format(len(regressions), args.threshold))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Release mode benchmark.
+
+Times an assignment-heavy loop on the closure engine with runtime type
+checks (the default) and in release mode, where Mem.release is set.
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from tokenizer import Tokenizer
+from parser import Parser
+from tree import Context, Mem
+
+LOOP = """
+int main() {
+    int a[64];
+    int i = 0;
+    int s = 0;
+    while (i < 200000) {
+        a[i % 64] += i;
+        s += a[(i * 7) % 64] % 10;
+        s -= 1;
+        i++;
+    }
+    return s;
+}
+"""
+REPEAT = 3
+
+
+def best_of(tree):
+    best = None
+    for _ in range(REPEAT):
+        run = tree.compile()
+        start = time.perf_counter()
+        v = run(Context(0, None, None, {}, {}))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, v
+
+
+def main():
+    tree = Parser().parse(Tokenizer().tokenize(LOOP))
+    tree.validate(Context(0, None, None, {}, {}))
+    checked, v = best_of(tree)
+    Mem.release = True
+    release, w = best_of(tree)
+    Mem.release = False
+    assert v == w
+    print("checked {:.3f}s, release {:.3f}s, {:.0f}% faster".format(
+        checked, release, (checked / release - 1) * 100))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""Tokenizer scaling benchmark.
+
+Lexes inputs built by repeating the programs in test_files/ from 10 KB up
+to 10 MB. Time per byte should stay flat as the input grows.
+"""
+import glob
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from tokenizer import Tokenizer
+
+SIZES = [10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+
+
+def make_input(size):
+    sources = [open(f).read() for f in sorted(
+        glob.glob(os.path.join(ROOT, 'test_files', '*.c')))]
+    chunk = '\n'.join(sources) + '\n'
+    return chunk * (size // len(chunk) + 1)
+
+
+def main():
+    T = Tokenizer()
+    print("{:>12} {:>10} {:>10} {:>12}".format('bytes', 'tokens', 'seconds', 'ns/byte'))
+    for size in SIZES:
+        code = make_input(size)
+        start = time.perf_counter()
+        tokens = T.tokenize(code)
+        elapsed = time.perf_counter() - start
+        print("{:>12} {:>10} {:>10.3f} {:>12.1f}".format(
+            len(code), len(tokens), elapsed, elapsed * 1e9 / len(code)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Bytecode VM benchmark.
+
+Runs every program in test_files/ with the tree walker (Root.evaluate) and
+with the bytecode VM, and prints the best time of a few runs for each.
+Program output is discarded.
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import frontend
+from tree import Context
+from vm import BytecodeCompiler, VM
+
+TEST_FILES = os.path.join(ROOT, 'test_files')
+REPEAT = 5
+
+
+def best_of(f):
+    best = None
+    for _ in range(REPEAT):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            f()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    print("{:<20} {:>12} {:>12} {:>9}".format('file', 'tree (ms)', 'vm (ms)', 'speedup'))
+    for name in sorted(os.listdir(TEST_FILES)):
+        if not name.endswith('.c'):
+            continue
+        tree = frontend.load(os.path.join(TEST_FILES, name))
+        program = BytecodeCompiler().compile(tree)
+        walk = best_of(lambda: tree.evaluate(Context(0, None, None, {}, {})))
+        vm = best_of(lambda: VM(program).run())
+        print("{:<20} {:>12.3f} {:>12.3f} {:>8.1f}x".format(
+            name, walk * 1e3, vm * 1e3, walk / vm))
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,24 @@
+import os
+import shutil
+import subprocess
 import pytest
 from compiler import *
+from exceptions import TokenizeFailedException, ParseException, \
+    WrongNumberOfArguments, UndefinedFunctionException, ArrayInitializeException
+from tree import Context, Mem
+import batch
+import cache
+import corpus
+import frontend
+from incremental import Incremental
+from generator import Generator
+import optimizer
+from pygen import PyGen
+from asm import AsmGen
+from vm import BytecodeCompiler, Program, VM, TAILCALL
 
 T = Tokenizer()
+TEST_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_files')
 
 def run_test_cases(test_cases):
     for _input, expected in test_cases.items():
@@ -26,3 +43,488 @@ def test_tokenizer_string():
         """ 'sdfe\nsdfef; eff' """: TokenizeFailedException("Unrecognized charactor '")
     }
     run_test_cases(test_cases)
+
+def test_tokenizer_scan_file(tmp_path):
+    code = "int main() { char c = '\u20ac'; char d = '\\n'; printf(\"%c%c\", c, d); return 0; }"
+    path = tmp_path / 'utf8.c'
+    path.write_text(code, encoding='utf-8')
+    assert list(T.scan_file(str(path))) == T.tokenize(code)
+
+def test_parser_stream():
+    code = open(os.path.join(TEST_FILES, 'parser_test.c')).read()
+    tokens = T.tokenize(code)
+    tree = Parser().parse(tokens)
+    streamed = list(Parser().parse_stream(iter(tokens)))
+    assert [f.to_str() for f in streamed] == [f.to_str() for f in tree.functions]
+
+def parse_return_expr(expr):
+    tree = Parser().parse(T.tokenize('int t() { return %s; }' % expr))
+    return tree.functions[0].body.statements[0].expr
+
+def test_parser_expr():
+    e = parse_return_expr('-a * b + c++ < 2 || !d')
+    assert e.op == '||' and e.right.op == '!'
+    lt = e.left
+    assert lt.op == '<' and lt.right.value == 2
+    plus = lt.left
+    assert plus.op == '+' and plus.right.op == 'R++'
+    assert plus.left.op == '*' and plus.left.left.op == '-'
+    e = parse_return_expr('a - b - c')
+    assert e.left.op == '-' and e.left.left.name == 'a'
+    with pytest.raises(ParseException):
+        parse_return_expr('(a)++')
+
+def run_program(path, backend, capsys, opt=()):
+    tree = optimizer.optimize(frontend.load(path), opt, out=None)
+    if backend == 'tree':
+        v = tree.evaluate(Context(0, None, None, {}, {}))
+    elif backend == 'py':
+        v = PyGen().run(tree)
+    elif backend == 'vm':
+        # round trip through serialization as well
+        program = Program.loads(BytecodeCompiler().compile(tree).dumps())
+        v = VM(program).run()
+    elif backend == 'release':
+        Mem.release = True
+        try:
+            v = tree.compile()(Context(0, None, None, {}, {}))
+        finally:
+            Mem.release = False
+    else:
+        v = tree.compile()(Context(0, None, None, {}, {}))
+    return v, capsys.readouterr().out
+
+@pytest.mark.parametrize('name', sorted(
+    f for f in os.listdir(TEST_FILES) if f.endswith('.c')))
+@pytest.mark.parametrize('backend', ['closure', 'release', 'py', 'vm'])
+def test_backend_matches_tree(name, backend, capsys):
+    path = os.path.join(TEST_FILES, name)
+    assert run_program(path, backend, capsys) == run_program(path, 'tree', capsys)
+
+@pytest.mark.parametrize('name', sorted(
+    f for f in os.listdir(TEST_FILES) if f.endswith('.c')))
+@pytest.mark.parametrize('opt', [
+    ['fold'], ['dce'], ['licm'], ['inline'], ['memo'],
+    ['inline', 'fold', 'dce', 'licm', 'memo']])
+def test_optimizer_matches_tree(name, opt, capsys):
+    path = os.path.join(TEST_FILES, name)
+    assert run_program(path, 'closure', capsys, opt) == run_program(path, 'tree', capsys)
+
+@pytest.mark.skipif(shutil.which('cc') is None, reason='needs a C toolchain')
+@pytest.mark.parametrize('name', sorted(
+    f for f in os.listdir(TEST_FILES) if f.endswith('.c')))
+def test_native_matches_tree(name, tmp_path, capsys):
+    path = os.path.join(TEST_FILES, name)
+    v, out = run_program(path, 'tree', capsys)
+    exe = str(tmp_path / 'a.out')
+    AsmGen().build(frontend.load(path), exe)
+    result = subprocess.run([exe], capture_output=True)
+    assert result.stdout.decode() == out
+    assert result.returncode == (v or 0) % 256
+
+@pytest.mark.skipif(shutil.which('cc') is None, reason='needs a C toolchain')
+def test_native_inlined_array_argument(tmp_path):
+    # the inlined argument is defined as an array initialized from b
+    tree = frontend.parse("""
+        int first(int a[2]) {
+            a[1] = a[0] + 1;
+            return a[0];
+        }
+        int main() {
+            int b[2] = {7, 0};
+            int x = first(b);
+            printf("%d %d", x, b[1]);
+            return x;
+        }""")
+    exe = str(tmp_path / 'a.out')
+    AsmGen().build(optimizer.optimize(tree, ['inline'], out=None), exe)
+    result = subprocess.run([exe], capture_output=True)
+    assert (result.stdout, result.returncode) == (b'7 8', 7)
+
+@pytest.mark.skipif(shutil.which('cc') is None, reason='needs a C toolchain')
+@pytest.mark.parametrize('seed', [8, 18])
+def test_native_matches_tree_generated(seed, tmp_path, capsys):
+    # calls with printf and other calls in their arguments
+    path = tmp_path / 'gen.c'
+    path.write_text(Generator(seed, calls=0.6, arrays=0.6, depth=4, expr_size=4,
+        printf=0.3).program(25))
+    v, out = run_program(str(path), 'tree', capsys)
+    exe = str(tmp_path / 'a.out')
+    AsmGen().build(frontend.load(str(path)), exe)
+    result = subprocess.run([exe], capture_output=True)
+    assert result.stdout.decode() == out
+    assert result.returncode == v % 256
+
+def test_array_initialize():
+    with pytest.raises(ArrayInitializeException) as excinfo:
+        frontend.parse('int main() { int a[2] = {1, 2, 3}; return a[0]; }')
+    assert str(excinfo.value) == "Expecting 2 elements in initializing array a but got 3"
+
+def test_int_array_overflow():
+    code = 'int main() { int a[2]; int x = 4611686018427387904; a[1] = x * 2; return a[1]; }'
+    with pytest.raises(RuntimeError, match='64 bit'):
+        frontend.parse(code).compile()(Context(0, None, None, {}, {}))
+    with pytest.raises(RuntimeError, match='64 bit'):
+        frontend.parse(code).evaluate(Context(0, None, None, {}, {}))
+
+def test_char_array_unicode(capsys):
+    code = """int main() {
+        char s[2] = {'a', '\u20ac'};
+        char t[2];
+        t[1] = '\u20ac';
+        printf("%c%c%c%c", s[0], s[1], t[0], t[1]);
+        return 0;
+    }"""
+    frontend.parse(code).compile()(Context(0, None, None, {}, {}))
+    frontend.parse(code).evaluate(Context(0, None, None, {}, {}))
+    assert capsys.readouterr().out == 'a\u20ac \u20ac' * 2
+
+def test_constant_folding():
+    tree = Parser().parse(T.tokenize('''
+        int f(int x) {
+            if (2 > 3) { return 0; }
+            return (x * 1 + 0) * (1 + 2 * 3) + x * 0 + -7 / 2 + ~0;
+        }'''))
+    tree.validate(Context(0, None, None, {}, {}))
+    p = optimizer.ConstantFolding()
+    p.run(tree)
+    body = tree.functions[0].body.statements
+    assert len(body) == 1
+    e = body[0].expr
+    assert e.op == '+' and e.right.value == -1
+    assert e.left.op == '+' and e.left.right.value == -4
+    assert e.left.left.op == '*' and e.left.left.left.name == 'x'
+    assert e.left.left.right.value == 7
+    assert p.stats['branches removed'] == 1
+
+NESTED = """
+int main() {
+    int total = 0;
+    int k = 3;
+    void add(int n) {
+        if (n > 0) {
+            total += k;
+            add(n - 1);
+        }
+    }
+    int a[] = {k, k + 1, total};
+    add(4);
+    if (true) {
+        int k = 100;
+        total += k + a[1];
+    }
+    return total;
+}
+"""
+
+@pytest.mark.parametrize('backend', ['closure', 'py'])
+def test_nested_scope(backend, tmp_path, capsys):
+    path = tmp_path / 'nested.c'
+    path.write_text(NESTED)
+    assert run_program(str(path), backend, capsys) == (116, '')
+
+def test_dead_code_elimination(tmp_path, capsys):
+    path = tmp_path / 'dce.c'
+    path.write_text("""
+        int unused(int x) { return x; }
+        int log(int x) { printf("%d;", x); return x; }
+        int main() {
+            int a = 3;
+            int b = a + 1;
+            int c = 0;
+            c = log(a);
+            if (false) { a = 4; }
+            return a;
+            a = 2;
+        }""")
+    tree = frontend.load(str(path))
+    p = optimizer.DeadCodeElimination()
+    tree = p.run(tree)
+    assert [f.name for f in tree.functions] == ['log', 'main']
+    assert p.removed['unused variables'] == ['b', 'c']
+    assert p.stats['unreachable statements removed'] == 1
+    assert tree.compile()(Context(0, None, None, {}, {})) == 3
+    assert capsys.readouterr().out == '3;'
+
+def test_loop_invariant_code_motion(tmp_path, capsys):
+    path = tmp_path / 'licm.c'
+    path.write_text("""
+        int main() {
+            int n = 20;
+            int s = 0;
+            int i = 0;
+            while (i < n - 1) {
+                int j = 0;
+                while (j < 2 * n) {
+                    s += n * n + j / n;
+                    j++;
+                }
+                i++;
+            }
+            return s;
+        }""")
+    expected = run_program(str(path), 'tree', capsys)
+    tree = frontend.load(str(path))
+    p = optimizer.LoopInvariantCodeMotion()
+    tree = p.run(tree)
+    # n - 1, 2 * n and n * n all end up before the outer loop, j / n stays
+    assert p.stats['expressions hoisted'] == 3
+    outer = tree.functions[0].body.statements[3]
+    assert [type(st).__name__ for st in outer.statements] == ['VarDef'] * 3 + ['While']
+    assert tree.compile()(Context(0, None, None, {}, {})) == expected[0]
+
+def test_licm_sibling_call(tmp_path, capsys):
+    # bump writes f's x behind g's back, so x + 1 stays in the loop
+    path = tmp_path / 'licm.c'
+    path.write_text("""
+        int f() {
+            int x = 0;
+            void bump() {
+                x += 10;
+            }
+            int g() {
+                int s = 0;
+                int i = 0;
+                while (i < 3) {
+                    s = x + 1;
+                    bump();
+                    i++;
+                }
+                return s;
+            }
+            return g() + x - 20;
+        }
+
+        int main() {
+            return f();
+        }""")
+    for backend in ['closure', 'py']:
+        assert run_program(str(path), backend, capsys, ['licm']) == (31, '')
+        assert run_program(str(path), backend, capsys) == (31, '')
+
+INLINE = """
+int max(int a, int b) {
+    if (a > b)
+        return a;
+    return b;
+}
+
+int fact(int n) {
+    if (n < 2)
+        return 1;
+    return n * fact(n - 1);
+}
+
+void show(int x) {
+    printf("%d;", x);
+}
+
+int main() {
+    int m = max(3, 8);
+    m = max(m, fact(4)) + 1;
+    show(m);
+    return max(m, fact(3));
+}
+"""
+
+def test_inliner(tmp_path, capsys):
+    path = tmp_path / 'inline.c'
+    path.write_text(INLINE)
+    expected = run_program(str(path), 'tree', capsys)
+    tree = frontend.load(str(path))
+    p = optimizer.Inliner()
+    tree = p.run(tree)
+    # max(m, fact(4)) + 1 is not a whole call, and fact is recursive
+    assert p.inlined == {'max': 2, 'show': 1}
+    assert run_program(str(path), 'closure', capsys, ['inline']) == expected
+    assert optimizer.Inliner(budget=5).run(frontend.load(str(path))) is not None
+
+def test_inliner_shadowed_callee(tmp_path, capsys):
+    # f's copy in main would call main's own g
+    path = tmp_path / 'inline.c'
+    path.write_text("""
+        int g(int x) { return x + 1; }
+        int f(int x) { return g(x); }
+        int main() {
+            int g(int y) { return y * 100; }
+            return f(2);
+        }""")
+    for backend in ['closure', 'py']:
+        assert run_program(str(path), backend, capsys, ['inline']) == (3, '')
+
+def test_inliner_shadowed_argument(tmp_path, capsys):
+    # the argument is the outer x, not the x being defined
+    path = tmp_path / 'inline.c'
+    path.write_text("""
+        int inc(int a) { return a + 1; }
+        int main() {
+            int x = 5;
+            if (true) {
+                int x = inc(x);
+                printf("%d;", x);
+            }
+            return x;
+        }""")
+    expected = run_program(str(path), 'tree', capsys)
+    assert expected == (5, '6;')
+    for backend in ['closure', 'py', 'vm']:
+        assert run_program(str(path), backend, capsys, ['inline']) == expected
+
+MEMO = """
+int fib(int n) {
+    if (n < 2) { return n; }
+    return fib(n - 1) + fib(n - 2);
+}
+
+int loud(int n) {
+    printf("%d ", n);
+    if (n > 0) { return loud(n - 1); }
+    return 0;
+}
+
+int main() {
+    loud(2);
+    return fib(30);
+}
+"""
+
+def test_memoization(tmp_path, capsys):
+    path = tmp_path / 'memo.c'
+    path.write_text(MEMO)
+    tree = optimizer.Memoization(size=4).run(frontend.load(str(path)))
+    fib, loud = tree.functions[0], tree.functions[1]
+    assert loud.memo is None
+    v = tree.compile()(Context(0, None, None, {}, {}))
+    assert v == 832040 and capsys.readouterr().out == '2 1 0 '
+    assert fib.memo.misses == 31 and fib.memo.hits == 28
+    assert len(fib.memo.table) == 4 and fib.memo.evictions == 27
+
+DEEP = """
+int sum(int n) {
+    if (n == 0) { return 0; }
+    return n + sum(n - 1);
+}
+
+int count(int n, int acc) {
+    if (n == 0) { return acc; }
+    return count(n - 1, acc + 1);
+}
+
+int main() {
+    printf("%d ", count(1000000, 0));
+    return sum(1000000);
+}
+"""
+
+def test_vm_deep_recursion(tmp_path, capsys):
+    path = tmp_path / 'deep.c'
+    path.write_text(DEEP)
+    program = BytecodeCompiler().compile(frontend.load(str(path)))
+    count = program.functions[program.index['count']]
+    assert TAILCALL in count.code[::2]
+    assert VM(program).run() == 500000500000
+    assert capsys.readouterr().out == '1000000 '
+
+def test_cache(tmp_path, capsys):
+    path = str(tmp_path / 'bubble_sort.c')
+    shutil.copy(os.path.join(TEST_FILES, 'bubble_sort.c'), path)
+    c = cache.Cache(str(tmp_path / 'cache'))
+    expected = frontend.load(path).to_str()
+    assert c.load(path).to_str() == expected
+    tree = c.load(path)
+    assert (c.hits, c.misses) == (1, 1)
+    assert tree.to_str() == expected
+    assert tree.compile()(Context(0, None, None, {}, {})) == 0
+    assert capsys.readouterr().out.startswith('4234123, ')
+    # a changed source is a new entry, which pushes the old one out
+    with open(path, 'a') as f:
+        f.write('\nint unused() { return 1; }\n')
+    c.max_bytes = os.path.getsize(os.path.join(c.path, os.listdir(c.path)[0])) * 3 // 2
+    c.load(path)
+    assert (c.hits, c.misses, c.evictions) == (1, 2, 1)
+    assert len(os.listdir(c.path)) == 1
+
+INCREMENTAL = """int twice(int x) {
+    return 2 * x;
+}
+
+int f(int x) {
+    return twice(x) + 1;
+}
+
+int main() {
+    return f(3);
+}
+"""
+
+def test_incremental():
+    inc = Incremental(INCREMENTAL)
+    def edit(old, new, stats):
+        start = inc.code.index(old)
+        inc.stats.clear()
+        inc.edit(start, start + len(old), new)
+        assert inc.root().to_str() == frontend.parse(inc.code).to_str()
+        assert {k: inc.stats[k] for k in stats} == stats
+    edit('2 * x', '3 * x', {'functions parsed': 1, 'functions validated': 1})
+    # f calls twice and fails, main only calls f
+    with pytest.raises(WrongNumberOfArguments):
+        edit('int twice(int x)', 'int twice(int x, int y)',
+            {'functions parsed': 2, 'functions validated': 1})
+    edit(', int y', '', {'functions parsed': 1, 'functions validated': 2})
+    # an open comment swallows functions until it is closed
+    with pytest.raises(ParseException):
+        edit('int f(', '/* int f(', {})
+    with pytest.raises(UndefinedFunctionException):
+        edit('int main', '*/ int main', {})
+    assert [c.func.name for c in inc.chunks] == ['twice', 'main']
+    edit('*/ ', '*/ int f(int x) { return x; } ',
+        {'functions parsed': 2, 'functions validated': 2})
+    assert inc.root().compile()(Context(0, None, None, {}, {})) == 3
+    # a // comment runs to the end of the line, past the functions around
+    # the edit
+    inc = Incremental('int f() { return 1; } int g() { return 2; }\nint main() { return f(); }\n')
+    at = inc.code.index(' int g')
+    inc.edit(at, at, ' //')
+    assert [c.func.name for c in inc.chunks] == ['f', 'main']
+    inc.edit(at, at + 3, '')
+    assert [c.func.name for c in inc.chunks] == ['f', 'g', 'main']
+
+def test_batch(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    shutil.copy(os.path.join(TEST_FILES, 'bubble_sort.c'), str(tmp_path / 'sub' / 'b.c'))
+    (tmp_path / 'a.c').write_text('int f( { }')
+    (tmp_path / 'c.c').write_text('int f() { return g(); }')
+    paths = batch.expand([str(tmp_path / 'c.c'), str(tmp_path)])
+    assert [os.path.relpath(p, str(tmp_path)) for p in paths] == ['c.c', 'a.c', 'sub/b.c']
+    report = batch.compile_files(paths + [str(tmp_path / 'missing.c')], jobs=2)
+    assert (report['ok'], report['failed']) == (1, 3)
+    assert [r.get('error') for r in report['files']] == [
+        'UndefinedFunctionException', 'ParseException', None, 'FileNotFoundError']
+    assert report['files'][2]['functions'] == 1
+
+def test_corpus(tmp_path):
+    report = corpus.run_corpus(corpus.find([TEST_FILES]), ['--no-cache'], jobs=2)
+    assert report['counts'] == {'pass': len(report['programs'])} and report['programs']
+    (tmp_path / 'wrong.c').write_text('int main() { printf("hi\\n"); return 1; }')
+    (tmp_path / 'wrong.expected').write_text('hi\n2\n')
+    (tmp_path / 'loop.c').write_text('int main() { while (true) { } return 0; }')
+    (tmp_path / 'loop.expected').write_text('')
+    (tmp_path / 'no_sidecar.c').write_text('int main() { return 0; }')
+    report = corpus.run_corpus(corpus.find([str(tmp_path)]), ['--no-cache'], timeout=1)
+    loop, wrong = report['programs']
+    assert loop['status'] == 'timeout'
+    assert wrong['status'] == 'fail' and '-2' in wrong['diff'] and '+1' in wrong['diff']
+
+@pytest.mark.parametrize('seed', range(4))
+def test_generator(seed, tmp_path, capsys):
+    code = Generator(seed, calls=0.4).program(30)
+    assert code == Generator(seed, calls=0.4).program(30)
+    path = str(tmp_path / 'gen.c')
+    with open(path, 'w') as f:
+        f.write(code)
+    expected = run_program(path, 'tree', capsys)
+    for backend in ['closure', 'py', 'vm']:
+        assert run_program(path, backend, capsys) == expected
+    assert run_program(path, 'closure', capsys, ['inline', 'fold', 'dce', 'licm']) == expected
+    # calls in arguments don't nest without bound
+    frontend.parse(Generator(seed, calls=0.8).program(20))
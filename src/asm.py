@@ -0,0 +1,380 @@
+import os
+import re
+import subprocess
+import tempfile
+from tree import *
+from runtime import *
+from exceptions import *
+
+# System V integer argument registers, used for calls into libc
+ARG_REGS = ['rdi', 'rsi', 'rdx', 'rcx', 'r8', 'r9']
+
+def quote(s):
+    chars = []
+    for b in s.encode():
+        c = chr(b)
+        if c in '\\"':
+            chars.append('\\' + c)
+        elif 32 <= b < 127:
+            chars.append(c)
+        else:
+            chars.append('\\{:03o}'.format(b))
+    return '"{}"'.format(''.join(chars))
+
+class AsmGen:
+    """ Translate a validated Root into x86-64 System V assembly for GAS.
+
+    Every int, bool and char is a 64 bit word, arrays live on the stack.
+    Functions take their arguments pushed on the stack, only printf is
+    called with the System V convention """
+
+    unit = ' '*4
+    nil = {'int': 0, 'bool': 0, 'char': ord(VarDef.nil['char'])}
+    arith = {'+': 'add', '-': 'sub', '*': 'imul'}
+    compare = {'>': 'g', '<': 'l', '>=': 'ge', '<=': 'le', '==': 'e', '!=': 'ne'}
+
+    def gen(self, root):
+        self.lines = ['.intel_syntax noprefix', '.text']
+        self.strings = {}
+        self.n_labels = 0
+        for f in root.functions:
+            self.gen_FuncDef(f)
+        self.gen_entry(any(f.name == 'main' for f in root.functions))
+        if self.strings:
+            self.lines.append('.section .rodata')
+            for s, label in self.strings.items():
+                self.lines.append(label + ':')
+                self.emit('.string ' + quote(s))
+        self.lines.append('.section .note.GNU-stack,"",@progbits')
+        return '\n'.join(self.lines) + '\n'
+
+    def build(self, root, output, cc='cc'):
+        # assemble and link with the C toolchain, which brings in libc
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'out.s')
+            with open(path, 'w') as f:
+                f.write(self.gen(root))
+            if subprocess.run([cc, '-o', output, path]).returncode != 0:
+                raise CodeGenException("{} could not build {}".format(cc, output))
+
+    def emit(self, line):
+        self.lines.append(self.unit + line)
+
+    def new_label(self):
+        self.n_labels += 1
+        return '.L{}'.format(self.n_labels)
+
+    def string(self, s):
+        if s not in self.strings:
+            self.strings[s] = '.LC{}'.format(len(self.strings))
+        return self.strings[s]
+
+    # the stack is kept 16 byte aligned between statements, depth counts
+    # the words pushed on top of that while evaluating an expression
+
+    def push(self, reg='rax'):
+        self.emit('push ' + reg)
+        self.depth += 1
+
+    def pop(self, reg='rax'):
+        self.emit('pop ' + reg)
+        self.depth -= 1
+
+    def addr(self, slot):
+        # arguments are above the return address, the last one nearest
+        # rbp, locals below rbp
+        if slot < self.n_args:
+            return 'QWORD PTR [rbp+{}]'.format(16 + 8*(self.n_args - 1 - slot))
+        return 'QWORD PTR [rbp-{}]'.format(8*(slot - self.n_args + 1))
+
+    def new_slot(self):
+        self.n_slots += 1
+        return self.n_slots - 1
+
+    # functions
+
+    def gen_FuncDef(self, f):
+        self.n_args, self.n_slots, self.depth = len(f.args), f.n_slots, 0
+        self.lines.append('mc_{}:'.format(f.name))
+        self.emit('push rbp')
+        self.emit('mov rbp, rsp')
+        header = len(self.lines)
+        self.gen_block(f.body)
+        self.emit('xor eax, eax')
+        self.emit('leave')
+        self.emit('ret')
+        size = 8*(self.n_slots - self.n_args)
+        if size:
+            self.lines.insert(header, self.unit + 'sub rsp, {}'.format((size + 15) // 16 * 16))
+
+    def gen_entry(self, has_main):
+        self.lines.append('.globl main')
+        self.lines.append('main:')
+        if has_main:
+            self.emit('push rbp')
+            self.emit('call mc_main')
+            self.emit('pop rbp')
+        else:
+            self.emit('xor eax, eax')
+        self.emit('ret')
+
+    # statements
+
+    def gen_block(self, block):
+        # arrays defined in a block are dropped from the stack when it ends
+        saved = None
+        if any(isinstance(st, VarDef) and st.len is not None for st in block.statements):
+            saved = self.addr(self.new_slot())
+            self.emit('mov {}, rsp'.format(saved))
+        for st in block.statements:
+            self.gen_statement(st)
+        if saved is not None:
+            self.emit('mov rsp, {}'.format(saved))
+
+    def gen_statement(self, st):
+        method = getattr(self, 'st_' + type(st).__name__, None)
+        if method is None:
+            self.expr(st)
+        else:
+            method(st)
+
+    def st_Block(self, st):
+        self.gen_block(st)
+
+    def st_FuncDef(self, st):
+        raise CodeGenException(
+            "Nested function {} is not supported by the asm backend".format(st.name))
+
+    def st_VarDef(self, v):
+        if v.len is not None:
+            return self.new_array(v)
+        if v.default is None:
+            self.emit('mov rax, {}'.format(self.nil[v.type]))
+        else:
+            self.expr(v.default)
+        self.emit('mov {}, rax'.format(self.addr(v.slot)))
+
+    def new_array(self, v):
+        _len, default, target = v.len, v.default, self.addr(v.slot)
+        values = []
+        if isinstance(default, ArrayInit):
+            # like the interpreter, the initializer decides the length
+            values = default.value
+            self.emit('mov rax, {}'.format(len(values)))
+        elif default is not None:
+            # another array, e.g. an inlined array argument: share it like
+            # a call does
+            self.expr(default)
+            self.emit('mov {}, rax'.format(target))
+            return
+        elif isinstance(_len, Tree):
+            self.expr(_len)
+        else:
+            self.emit('mov rax, {}'.format(_len))
+        self.emit('mov rcx, rax')
+        self.emit('lea rax, [rax*8+15]')
+        self.emit('and rax, -16')
+        self.emit('sub rsp, rax')
+        self.emit('mov rdi, rsp')
+        self.emit('mov {}, rsp'.format(target))
+        self.emit('mov rax, {}'.format(self.nil[v.type]))
+        self.emit('rep stosq')
+        for i, value in enumerate(values):
+            self.expr(value)
+            self.emit('mov rcx, {}'.format(target))
+            self.emit('mov QWORD PTR [rcx+{}], rax'.format(8*i))
+
+    def st_Assignment(self, a):
+        ref, op = a.ref, a.op
+        if isinstance(ref, ArrayRef):
+            # the value first, like the other backends
+            self.expr(a.expr)
+            self.push()
+            self.expr(ref.index)
+            self.emit('mov rdi, rax')
+            self.pop()
+            self.emit('mov rsi, {}'.format(self.addr(ref.slot)))
+            target = 'QWORD PTR [rsi+rdi*8]'
+        else:
+            self.expr(a.expr)
+            target = self.addr(ref.slot)
+        if op != '=':
+            self.emit('mov rcx, rax')
+            self.emit('mov rax, {}'.format(target))
+            self.binary_op(op[0])
+        self.emit('mov {}, rax'.format(target))
+
+    def st_Return(self, r):
+        if r.expr == None:
+            self.emit('xor eax, eax')
+        else:
+            self.expr(r.expr)
+        self.emit('leave')
+        self.emit('ret')
+
+    def st_If(self, st):
+        to_else = self.new_label()
+        self.expr(st.cond)
+        self.emit('test rax, rax')
+        self.emit('je ' + to_else)
+        self.gen_block(st.true_body)
+        if st.false_body != None:
+            to_end = self.new_label()
+            self.emit('jmp ' + to_end)
+            self.lines.append(to_else + ':')
+            self.gen_block(st.false_body)
+            self.lines.append(to_end + ':')
+        else:
+            self.lines.append(to_else + ':')
+
+    def st_While(self, st):
+        start, to_end = self.new_label(), self.new_label()
+        self.lines.append(start + ':')
+        self.expr(st.cond)
+        self.emit('test rax, rax')
+        self.emit('je ' + to_end)
+        self.gen_block(st.body)
+        self.emit('jmp ' + start)
+        self.lines.append(to_end + ':')
+
+    def st_Printf(self, p):
+        if not isinstance(p.format, Literal):
+            raise CodeGenException("printf needs a literal format with the asm backend")
+        if len(p.params) >= len(ARG_REGS):
+            raise CodeGenException("printf takes at most {} values with the asm backend".format(
+                len(ARG_REGS) - 1))
+        for v in p.params:
+            self.expr(v)
+            self.push()
+        for reg in reversed(ARG_REGS[1:len(p.params) + 1]):
+            self.pop(reg)
+        # every int is 64 bit wide
+        _format = re.sub(r'%([di])', r'%l\1', p.format.value)
+        self.emit('lea rdi, [rip+{}]'.format(self.string(_format)))
+        self.emit('xor eax, eax')
+        pad = self.depth % 2
+        if pad:
+            self.emit('sub rsp, 8')
+            self.depth += 1
+        self.call('printf@PLT', pad)
+
+    def call(self, name, n_words=0):
+        # n_words arguments are already pushed, and the stack has to be 16
+        # byte aligned at the call
+        self.emit('call ' + name)
+        if n_words:
+            self.emit('add rsp, {}'.format(8*n_words))
+            self.depth -= n_words
+
+    # expressions, their value ends up in rax
+
+    def expr(self, e):
+        if isinstance(e, Literal):
+            self.literal(e)
+        elif isinstance(e, VarRef):
+            self.emit('mov rax, {}'.format(self.addr(e.slot)))
+        elif isinstance(e, ArrayRef):
+            self.expr(e.index)
+            self.emit('mov rcx, {}'.format(self.addr(e.slot)))
+            self.emit('mov rax, QWORD PTR [rcx+rax*8]')
+        elif isinstance(e, FuncCall):
+            self.func_call(e)
+        elif isinstance(e, BinaryOp):
+            self.binary(e)
+        elif isinstance(e, UnaryOp):
+            self.unary(e)
+        else:
+            raise CodeGenException(
+                "{} is not supported by the asm backend".format(type(e).__name__))
+
+    def literal(self, e):
+        value = e.value
+        if e.type == 'string':
+            self.emit('lea rax, [rip+{}]'.format(self.string(value)))
+            return
+        if e.type == 'char':
+            value = ord(value)
+        elif e.type not in ['int', 'bool']:
+            raise CodeGenException("{} literals are not supported by the asm backend".format(e.type))
+        self.emit('mov rax, {}'.format(int(value)))
+
+    def func_call(self, e):
+        n = len(e.params)
+        pad = (self.depth + n) % 2
+        if pad:
+            self.emit('sub rsp, 8')
+            self.depth += 1
+        # evaluated and pushed first to last, like the other backends
+        for p in e.params:
+            self.expr(p)
+            self.push()
+        self.call('mc_' + e.name, n + pad)
+
+    def binary(self, e):
+        op = e.op
+        self.expr(e.left)
+        if op in ['&&', '||']:
+            to_end = self.new_label()
+            self.emit('test rax, rax')
+            self.emit(('je ' if op == '&&' else 'jne ') + to_end)
+            self.expr(e.right)
+            self.lines.append(to_end + ':')
+            return
+        self.push()
+        self.expr(e.right)
+        self.emit('mov rcx, rax')
+        self.pop()
+        self.binary_op(op)
+
+    def binary_op(self, op):
+        # rax = rax op rcx
+        if op in self.arith:
+            self.emit('{} rax, rcx'.format(self.arith[op]))
+        elif op in self.compare:
+            self.emit('cmp rax, rcx')
+            self.emit('set{} al'.format(self.compare[op]))
+            self.emit('movzx eax, al')
+        elif op in ['/', '%']:
+            # idiv truncates, python and so the interpreter round down
+            done = self.new_label()
+            self.emit('cqo')
+            self.emit('idiv rcx')
+            self.emit('test rdx, rdx')
+            self.emit('je ' + done)
+            self.emit('mov r8, rdx')
+            self.emit('xor r8, rcx')
+            self.emit('jns ' + done)
+            self.emit('sub rax, 1' if op == '/' else 'add rdx, rcx')
+            self.lines.append(done + ':')
+            if op == '%':
+                self.emit('mov rax, rdx')
+        else:
+            raise CodeGenException("Operator {} not supported yet".format(op))
+
+    def unary(self, e):
+        op, child = e.op, e.child
+        if op in ['+', '-', '!', '~']:
+            self.expr(child)
+            if op == '-':
+                self.emit('neg rax')
+            elif op == '!':
+                self.emit('xor rax, 1')
+            elif op == '~':
+                # same 32 bit wrap as UnaryOp.invert
+                self.emit('movsxd rax, eax')
+                self.emit('not rax')
+            return
+        if isinstance(child, ArrayRef):
+            self.expr(child.index)
+            self.emit('mov rcx, {}'.format(self.addr(child.slot)))
+            target = 'QWORD PTR [rcx+rax*8]'
+        else:
+            target = self.addr(child.slot)
+        step = 'add {}, 1' if op[1] == '+' else 'sub {}, 1'
+        if op[0] == 'R':
+            self.emit('mov rdx, {}'.format(target))
+            self.emit(step.format(target))
+            self.emit('mov rax, rdx')
+        else:
+            self.emit(step.format(target))
+            self.emit('mov rax, {}'.format(target))
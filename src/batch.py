@@ -0,0 +1,92 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import frontend
+
+
+def expand(paths, files_from=None):
+    """ Files named by paths, directories (every .c file under them) and
+    glob patterns, in the order given and without repeats """
+    names = []
+    if files_from is not None:
+        f = sys.stdin if files_from == '-' else open(files_from)
+        with f:
+            paths = list(paths) + [line.strip() for line in f if line.strip()]
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                names.extend(os.path.join(root, name) for name in sorted(files)
+                    if name.endswith('.c'))
+        elif os.path.exists(path):
+            names.append(path)
+        else:
+            matches = sorted(glob.glob(path, recursive=True))
+            # a missing file is reported like any other failure
+            names.extend(matches or [path])
+    return list(dict.fromkeys(names))
+
+def compile_file(path):
+    start = time.perf_counter()
+    try:
+        tree = frontend.load(path)
+    except Exception as e:
+        return {'path': path, 'ok': False, 'error': type(e).__name__, 'message': str(e),
+            'seconds': time.perf_counter() - start}
+    return {'path': path, 'ok': True, 'functions': len(tree.functions),
+        'seconds': time.perf_counter() - start}
+
+def compile_files(paths, jobs=None):
+    """ Tokenize, parse and validate every file over jobs processes, and
+    return a report with one result per file in the order of paths """
+    start = time.perf_counter()
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(paths) < 2:
+        results = [compile_file(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(jobs) as pool:
+            # results come back in order, a few files per round trip
+            chunksize = max(1, len(paths) // (jobs * 8))
+            results = list(pool.map(compile_file, paths, chunksize=chunksize))
+    ok = sum(r['ok'] for r in results)
+    return {
+        'files': results,
+        'ok': ok,
+        'failed': len(results) - ok,
+        'jobs': jobs,
+        'seconds': time.perf_counter() - start
+    }
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Tokenize, parse and validate many mini-C files in parallel')
+    arg_parser.add_argument('paths', nargs='*',
+        help='files, directories (searched for .c files) or glob patterns')
+    arg_parser.add_argument('--files-from', metavar='FILE',
+        help="read more paths from FILE, one per line ('-' for stdin)")
+    arg_parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of worker processes (default: one per CPU)')
+    arg_parser.add_argument('--report', metavar='FILE',
+        help='write the JSON report to FILE instead of stdout')
+    args = arg_parser.parse_args()
+    if not args.paths and args.files_from is None:
+        arg_parser.error('no input files')
+
+    report = compile_files(expand(args.paths, args.files_from), args.jobs)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    print("{} ok, {} failed in {:.2f}s with {} jobs".format(
+        report['ok'], report['failed'], report['seconds'], report['jobs']), file=sys.stderr)
+    sys.exit(1 if report['failed'] else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import pickle
+import sys
+import frontend
+
+# modules whose code decides what a validated tree looks like
+FRONTEND = ['tokenizer', 'parser', 'tree', 'runtime', 'utils', 'exceptions']
+
+def compiler_version():
+    h = hashlib.sha256()
+    src = os.path.dirname(os.path.abspath(__file__))
+    for name in FRONTEND:
+        with open(os.path.join(src, name + '.py'), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+class Cache:
+    """ Validated trees pickled on disk, keyed by a hash of the source and
+    of the front end. An entry's mtime is its last use, the least recently
+    used ones are removed once the directory is over max_bytes """
+
+    default_path = os.path.join(os.path.expanduser('~'), '.cache', 'mini-c')
+
+    def __init__(self, path=None, max_bytes=64 << 20):
+        self.path = path or self.default_path
+        self.max_bytes = max_bytes
+        self.version = compiler_version()
+        self.hits = self.misses = self.evictions = 0
+
+    def __repr__(self):
+        return "cache: {} hits, {} misses, {} evictions".format(
+            self.hits, self.misses, self.evictions)
+
+    def key(self, code):
+        return hashlib.sha256(self.version.encode() + code).hexdigest()
+
+    def load(self, path):
+        with open(path, 'rb') as f:
+            code = f.read()
+        entry = os.path.join(self.path, self.key(code) + '.pickle')
+        try:
+            with open(entry, 'rb') as f:
+                tree = pickle.load(f)
+            os.utime(entry)
+            self.hits += 1
+            return tree
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+        self.misses += 1
+        tree = frontend.parse(code.decode())
+        self.store(entry, tree)
+        return tree
+
+    def store(self, entry, tree):
+        os.makedirs(self.path, exist_ok=True)
+        # written aside and renamed, so readers never see half an entry
+        tmp = '{}.{}.tmp'.format(entry, os.getpid())
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, 10000))
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump(tree, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, entry)
+        finally:
+            sys.setrecursionlimit(limit)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.pickle'):
+                try:
+                    st = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+def add_arguments(arg_parser):
+    arg_parser.add_argument('--no-cache', action='store_true',
+        help='always tokenize, parse and validate instead of loading a cached tree')
+    arg_parser.add_argument('--cache-dir', default=Cache.default_path,
+        help='where validated trees are cached (default: %(default)s)')
+    arg_parser.add_argument('--cache-size', type=int, default=64,
+        help='size limit of the cache directory in MiB (default: %(default)s)')
+    arg_parser.add_argument('--cache-stats', action='store_true',
+        help='print cache hits, misses and evictions to stderr')
+
+def load_args(path, args):
+    if args.no_cache:
+        return frontend.load(path)
+    cache = Cache(args.cache_dir, args.cache_size << 20)
+    tree = cache.load(path)
+    if args.cache_stats:
+        print(cache, file=sys.stderr)
+    return tree
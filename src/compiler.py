@@ -1,10 +1,59 @@
-import sys
+import argparse
+import cache
+import frontend
+import optimizer
+from pygen import PyGen
+from asm import AsmGen
+from vm import BytecodeCompiler, disassemble
 from tokenizer import Tokenizer
 from parser import Parser
 
 
 def main():
-    code = open(sys.argv[1]).read()
+    arg_parser = argparse.ArgumentParser(description='Compile a mini-C program')
+    arg_parser.add_argument('file')
+    arg_parser.add_argument('--stream', action='store_true',
+        help='lex, parse and validate the file incrementally, printing each function as it is ready')
+    arg_parser.add_argument('--backend', choices=['py', 'vm', 'asm'],
+        help='print generated code for this backend instead of tokens and syntax tree')
+    optimizer.add_arguments(arg_parser)
+    cache.add_arguments(arg_parser)
+    arg_parser.add_argument('-o', '--output',
+        help='with --backend vm, write the serialized bytecode to this file; '
+            'with --backend asm, assemble and link a native executable')
+    args = arg_parser.parse_args()
+    if args.stream and args.opt:
+        arg_parser.error('--opt needs the whole program, it can not be used with --stream')
+
+    if args.backend == 'vm':
+        tree = optimizer.optimize_args(cache.load_args(args.file, args), args)
+        program = BytecodeCompiler().compile(tree)
+        if args.output:
+            with open(args.output, 'wb') as f:
+                f.write(program.dumps())
+        else:
+            print(disassemble(program), end='')
+        return
+
+    if args.backend == 'asm':
+        tree = optimizer.optimize_args(cache.load_args(args.file, args), args)
+        if args.output:
+            AsmGen().build(tree, args.output)
+        else:
+            print(AsmGen().gen(tree), end='')
+        return
+
+    if args.backend == 'py':
+        tree = optimizer.optimize_args(cache.load_args(args.file, args), args)
+        print(PyGen().gen(tree), end='')
+        return
+
+    if args.stream:
+        for f in frontend.stream(args.file):
+            print(f.to_str())
+        return
+
+    code = open(args.file).read()
 
     # Tokenize
     T = Tokenizer()
@@ -18,6 +67,7 @@ def main():
 
     # Validate
     tree.validate()
+    tree = optimizer.optimize_args(tree, args)
     print(tree.to_str())
 
 if __name__ == '__main__':
@@ -0,0 +1,110 @@
+import argparse
+import difflib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import batch
+
+INTERPRETER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'interpreter.py')
+
+# A program's sidecar holds what interpreter.py prints for it: the printf
+# output, then main's return value on the last line
+SIDECAR = '.expected'
+
+
+def find(paths, all=False):
+    """ .c files with a sidecar (or all of them), found like batch.py
+    finds its inputs """
+    return [p for p in batch.expand(paths) if all or os.path.exists(sidecar(p))]
+
+def sidecar(path):
+    return os.path.splitext(path)[0] + SIDECAR
+
+def run_program(path, options=(), timeout=60):
+    # every program gets its own interpreter process, which can be killed
+    # once its time is up
+    start = time.perf_counter()
+    try:
+        p = subprocess.run([sys.executable, INTERPRETER] + list(options) + [path],
+            capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {'path': path, 'status': 'timeout', 'seconds': time.perf_counter() - start}
+    result = {'path': path, 'seconds': time.perf_counter() - start}
+    if p.returncode != 0:
+        result.update(status='error', message=p.stderr.strip().splitlines()[-1:])
+        return result
+    with open(sidecar(path)) as f:
+        expected = f.read()
+    if p.stdout == expected:
+        result['status'] = 'pass'
+    else:
+        result.update(status='fail', diff=list(difflib.unified_diff(
+            expected.splitlines(), p.stdout.splitlines(), 'expected', 'got', lineterm='')))
+    return result
+
+def run_corpus(paths, options=(), jobs=None, timeout=60):
+    """ Run every program concurrently, and return the results in the
+    order of paths """
+    start = time.perf_counter()
+    jobs = jobs or os.cpu_count() or 1
+    with ThreadPoolExecutor(jobs) as pool:
+        results = list(pool.map(lambda p: run_program(p, options, timeout), paths))
+    counts = {}
+    for r in results:
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+    return {'programs': results, 'counts': counts, 'jobs': jobs,
+        'seconds': time.perf_counter() - start}
+
+def update(paths, options=()):
+    for path in paths:
+        p = subprocess.run([sys.executable, INTERPRETER] + list(options) + [path],
+            capture_output=True, text=True, check=True)
+        with open(sidecar(path), 'w') as f:
+            f.write(p.stdout)
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Run mini-C programs in parallel and check them against their {} files'.format(SIDECAR))
+    arg_parser.add_argument('paths', nargs='*', default=['test_files'],
+        help='programs or directories to search (default: test_files)')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of programs run at once (default: one per CPU)')
+    arg_parser.add_argument('--timeout', type=float, default=60,
+        help='seconds a program may run (default: %(default)s)')
+    arg_parser.add_argument('--report', metavar='FILE',
+        help='also write the results as JSON to FILE')
+    arg_parser.add_argument('--update', action='store_true',
+        help='write the sidecars from the current output instead of checking them')
+    arg_parser.add_argument('--backend', choices=['closure', 'tree', 'py', 'vm'],
+        help='passed on to interpreter.py')
+    arg_parser.add_argument('--release', action='store_true',
+        help='passed on to interpreter.py')
+    args = arg_parser.parse_args()
+    options = ['--no-cache']
+    if args.backend:
+        options += ['--backend', args.backend]
+    if args.release:
+        options.append('--release')
+
+    if args.update:
+        update(find(args.paths, all=True), options)
+        return
+
+    report = run_corpus(find(args.paths), options, args.jobs, args.timeout)
+    for r in report['programs']:
+        print("{:<7} {:>9.1f} ms  {}".format(r['status'], 1000 * r['seconds'], r['path']))
+        for line in r.get('diff', []) + r.get('message', []):
+            print("        " + line)
+    print(', '.join('{} {}'.format(n, status) for status, n in sorted(report['counts'].items())) +
+        ' in {:.2f}s with {} jobs'.format(report['seconds'], report['jobs']))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    sys.exit(0 if set(report['counts']) <= {'pass'} else 1)
+
+if __name__ == '__main__':
+    main()
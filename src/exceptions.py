@@ -98,3 +98,6 @@ class UnimplementedRuntimeException(ParseException):
 
     def __init__(self, name):
         super().__init__("Runtime function {} is not implemented".format(name))
+
+class CodeGenException(Exception):
+    pass
@@ -0,0 +1,20 @@
+from tokenizer import Tokenizer
+from parser import Parser
+from tree import Root, Context
+
+
+def load(path):
+    return parse(open(path).read())
+
+def parse(code):
+    tree = Parser().parse(Tokenizer().tokenize(code))
+    tree.validate(Context(0, None, None, {}, {}))
+    return tree
+
+def stream(path):
+    # Each function is validated as soon as the parser completes it, while
+    # the rest of the file is still being lexed from a memory map
+    ctx = Context(0, None, None, {}, {})
+    for f in Parser().parse_stream(Tokenizer().scan_file(path)):
+        f.validate(ctx)
+        yield f
@@ -0,0 +1,312 @@
+import argparse
+import random
+import sys
+
+
+class Generator:
+    """ Seeded random mini-C programs that pass validate and terminate.
+
+    Functions only call functions defined before them, loops count up to
+    a small bound, divisors are non zero literals, array indexes are
+    taken modulo the array's length and ints are kept small with % so the
+    interpreter never works on huge numbers. Calls are only made when the
+    callee's estimated cost, times the enclosing loop bounds, stays under
+    max_cost """
+
+    unit = ' '*4
+    chars = 'abcxyz'
+    max_nesting = 2
+
+    def __init__(self, seed=0, statements=8, depth=3, expr_size=3, arrays=0.3,
+            calls=0.2, printf=0.1, max_cost=2000):
+        self.random = random.Random(seed)
+        self.statements = statements
+        self.depth = depth
+        self.expr_size = expr_size
+        self.arrays = arrays
+        self.calls = calls
+        self.printf = printf
+        self.max_cost = max_cost
+        self.signatures = []  # (name, type, arg types, cost) of every function so far
+        self.nesting = 0
+
+    def program(self, functions=100):
+        return ''.join(self.functions(functions)) + self.main()
+
+    def functions(self, n=None):
+        """ Yield the source of n functions, or never stop """
+        i = 0
+        while n is None or i < n:
+            yield self.function()
+            i += 1
+
+    def write(self, f, functions=100, size=None):
+        """ Write a program to f, with functions functions or at least
+        size characters """
+        written = 0
+        for text in self.functions(None if size else functions):
+            f.write(text)
+            written += len(text)
+            if size and written >= size:
+                break
+        f.write(self.main())
+
+    # functions
+
+    def function(self):
+        r = self.random
+        name = 'f{}'.format(len(self.signatures))
+        _type = 'int' if r.random() < 0.7 else 'bool'
+        arg_types = [r.choice(['int', 'int', 'bool', 'char']) for _ in range(r.randint(0, 3))]
+        self.n_names, self.cost = 0, 0
+        self.scopes = [[]]
+        args = ['{} {}'.format(t, self.declare('p', t)) for t in arg_types]
+        lines = ['{} {}({}) {{'.format(_type, name, ', '.join(args))]
+        lines += self.block(1, 1, self.statements)
+        lines.append(self.unit + 'return {};'.format(self.expr(_type, self.expr_size)))
+        lines.append('}')
+        self.signatures.append((name, _type, arg_types, self.cost + 1))
+        return '\n'.join(lines) + '\n\n'
+
+    def main(self):
+        self.n_names, self.cost = 0, 0
+        self.scopes = [[]]
+        lines = ['int main() {', self.unit + 'int total = 0;']
+        for name, _type, arg_types, cost in self.signatures[-10:]:
+            if _type == 'int' and cost <= self.max_cost:
+                lines.append(self.unit + 'total = (total + {}) % 1000;'.format(
+                    self.call_args(name, arg_types)))
+        if self.printf:
+            lines.append(self.unit + 'printf("%d\\n", total);')
+        lines.append(self.unit + 'return total;')
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    # names
+
+    def declare(self, prefix, _type, kind='var', size=None):
+        name = '{}{}'.format(prefix, self.n_names)
+        self.n_names += 1
+        self.scopes[-1].append((name, _type, kind, size))
+        return name
+
+    def visible(self, _type, kinds=('var', 'counter')):
+        return [v for scope in self.scopes for v in scope if v[1] == _type and v[2] in kinds]
+
+    # statements
+
+    def block(self, indent, mult, n):
+        self.scopes.append([])
+        lines = []
+        for _ in range(n):
+            lines += self.statement(indent, mult)
+        self.scopes.pop()
+        return lines
+
+    def statement(self, indent, mult):
+        r = self.random
+        pad = self.unit * indent
+        self.cost += mult
+        if r.random() < self.printf:
+            return [pad + self.printf_statement()]
+        k = r.random()
+        if indent <= self.depth and k < 0.2:
+            return self.if_statement(indent, mult)
+        if indent <= self.depth and k < 0.3:
+            return self.while_statement(indent, mult)
+        if k < 0.45 and r.random() < self.arrays:
+            _type = r.choice(['int', 'int', 'bool', 'char'])
+            size = r.randint(2, 16)
+            return [pad + '{} {}[{}];'.format(_type, self.declare('a', _type, 'array', size), size)]
+        if k < 0.6:
+            _type = r.choice(['int', 'int', 'bool', 'char'])
+            value = self.expr(_type, self.expr_size)
+            return [pad + '{} {} = {};'.format(_type, self.declare('v', _type), value)]
+        return [pad + self.assignment()]
+
+    def if_statement(self, indent, mult):
+        pad = self.unit * indent
+        n = max(1, self.statements // 2)
+        lines = [pad + 'if ({}) {{'.format(self.expr('bool', self.expr_size))]
+        lines += self.block(indent + 1, mult, n)
+        if self.random.random() < 0.5:
+            lines.append(pad + '} else {')
+            lines += self.block(indent + 1, mult, n)
+        lines.append(pad + '}')
+        return lines
+
+    def while_statement(self, indent, mult):
+        pad = self.unit * indent
+        bound = self.random.randint(1, 4)
+        counter = self.declare('i', 'int', 'counter')
+        lines = [pad + 'int {} = 0;'.format(counter),
+            pad + 'while ({} < {}) {{'.format(counter, bound)]
+        lines += self.block(indent + 1, mult * bound, max(1, self.statements // 2))
+        lines.append(pad + self.unit + '{}++;'.format(counter))
+        lines.append(pad + '}')
+        return lines
+
+    def printf_statement(self):
+        r = self.random
+        holes, values = [], []
+        for _ in range(r.randint(0, 3)):
+            if r.random() < 0.7:
+                holes.append('%d')
+                values.append(self.expr('int', 2))
+            else:
+                holes.append('%c')
+                values.append(self.expr('char', 1))
+        _format = '"{}\\n"'.format(' '.join(['f{}'.format(len(self.signatures))] + holes))
+        return 'printf({});'.format(', '.join([_format] + values))
+
+    def assignment(self):
+        r = self.random
+        k = r.random()
+        arrays = [v for scope in self.scopes for v in scope if v[2] == 'array']
+        if arrays and k < 0.3:
+            name, _type, _, size = r.choice(arrays)
+            return '{}[{}] = {};'.format(name, self.index(size), self.expr(_type, self.expr_size))
+        _type = r.choice(['int', 'int', 'bool', 'char'])
+        targets = self.visible(_type, ('var',))
+        if not targets:
+            value = self.expr(_type, self.expr_size)
+            return '{} {} = {};'.format(_type, self.declare('v', _type), value)
+        name = r.choice(targets)[0]
+        if _type == 'int' and k < 0.5:
+            return '{}++;'.format(name) if k < 0.4 else '{} += {};'.format(name, r.randint(1, 9))
+        return '{} = {};'.format(name, self.expr(_type, self.expr_size))
+
+    # expressions, kept parenthesized so precedence never matters
+
+    def expr(self, _type, size):
+        if _type == 'int':
+            return '({}) % 1000'.format(self.int_expr(size)) if size > 1 else self.int_expr(size)
+        if _type == 'bool':
+            return self.bool_expr(size)
+        return self.char_expr()
+
+    def index(self, size):
+        return '({}) % {}'.format(self.int_expr(1), size)
+
+    def int_expr(self, size):
+        r = self.random
+        k = r.random()
+        if size > 1 and k < 0.5:
+            return '({} {} {})'.format(
+                self.int_expr(size - 1), r.choice('+-*'), self.int_expr(size - 1))
+        if size > 1 and k < 0.6:
+            return '({} {} {})'.format(self.int_expr(size - 1), r.choice('/%'), r.randint(1, 9))
+        if k < 0.7:
+            return '(-{})'.format(self.int_atom())
+        call = self.call('int')
+        return call or self.int_atom()
+
+    def int_atom(self):
+        r = self.random
+        k = r.random()
+        arrays = self.visible('int', ('array',))
+        if arrays and k < 0.2:
+            name, _, _, size = r.choice(arrays)
+            return '{}[{}]'.format(name, self.index(size))
+        names = self.visible('int')
+        if names and k < 0.7:
+            return r.choice(names)[0]
+        return str(r.randint(0, 100))
+
+    def bool_expr(self, size):
+        r = self.random
+        k = r.random()
+        if size > 1 and k < 0.3:
+            return '({} {} {})'.format(
+                self.bool_expr(size - 1), r.choice(['&&', '||']), self.bool_expr(size - 1))
+        if size > 1 and k < 0.6:
+            return '({} {} {})'.format(
+                self.int_expr(size - 1), r.choice(['<', '>', '<=', '>=', '==', '!=']),
+                self.int_expr(size - 1))
+        if k < 0.65:
+            return '(!{})'.format(self.bool_expr(1))
+        if k < 0.7:
+            return '({} {} {})'.format(self.char_expr(), r.choice(['==', '!=']), self.char_expr())
+        call = self.call('bool')
+        if call:
+            return call
+        arrays = self.visible('bool', ('array',))
+        if arrays and k < 0.8:
+            name, _, _, size = r.choice(arrays)
+            return '{}[{}]'.format(name, self.index(size))
+        names = self.visible('bool')
+        if names and k < 0.9:
+            return r.choice(names)[0]
+        return r.choice(['true', 'false'])
+
+    def char_expr(self):
+        r = self.random
+        arrays = self.visible('char', ('array',))
+        names = self.visible('char')
+        k = r.random()
+        if arrays and k < 0.2:
+            name, _, _, size = r.choice(arrays)
+            return '{}[{}]'.format(name, self.index(size))
+        if names and k < 0.6:
+            return r.choice(names)[0]
+        return "'{}'".format(r.choice(self.chars))
+
+    def call(self, _type):
+        # only earlier functions, so the call graph has no cycles, and
+        # calls in arguments nest at most max_nesting deep
+        if not self.signatures or self.nesting >= self.max_nesting or \
+                self.random.random() >= self.calls:
+            return None
+        name, f_type, arg_types, cost = self.random.choice(self.signatures)
+        if f_type != _type or cost > self.max_cost:
+            return None
+        self.cost += cost
+        return self.call_args(name, arg_types)
+
+    def call_args(self, name, arg_types):
+        self.nesting += 1
+        args = ', '.join(self.expr(t, 1) for t in arg_types)
+        self.nesting -= 1
+        return '{}({})'.format(name, args)
+
+def parse_size(s):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    if s[-1:].upper() in units:
+        return int(float(s[:-1]) * units[s[-1].upper()])
+    return int(s)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Generate a random, valid mini-C program')
+    arg_parser.add_argument('-n', '--functions', type=int, default=100,
+        help='number of functions besides main (default: %(default)s)')
+    arg_parser.add_argument('--size',
+        help='instead of --functions, generate functions until the program is this big, e.g. 10M')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--statements', type=int, default=8,
+        help='statements per function body (default: %(default)s)')
+    arg_parser.add_argument('--depth', type=int, default=3,
+        help='how deep if and while nest (default: %(default)s)')
+    arg_parser.add_argument('--expr-size', type=int, default=3,
+        help='how deep expressions nest (default: %(default)s)')
+    arg_parser.add_argument('--arrays', type=float, default=0.3,
+        help='how often a definition is an array (default: %(default)s)')
+    arg_parser.add_argument('--calls', type=float, default=0.2,
+        help='how often an operand is a call to an earlier function (default: %(default)s)')
+    arg_parser.add_argument('--printf', type=float, default=0.1,
+        help='how often a statement is a printf (default: %(default)s)')
+    arg_parser.add_argument('--max-cost', type=int, default=2000,
+        help='rough limit on the statements a single call may run (default: %(default)s)')
+    arg_parser.add_argument('-o', '--output', help='write here instead of stdout')
+    args = arg_parser.parse_args()
+
+    g = Generator(args.seed, args.statements, args.depth, args.expr_size,
+        args.arrays, args.calls, args.printf, args.max_cost)
+    size = parse_size(args.size) if args.size else None
+    if args.output:
+        with open(args.output, 'w') as f:
+            g.write(f, args.functions, size)
+    else:
+        g.write(sys.stdout, args.functions, size)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+from collections import Counter
+from tokenizer import Tokenizer, COMMENT
+from parser import Parser
+from tree import Root, Context
+from optimizer import called_names
+from exceptions import *
+
+
+class Chunk:
+    """ One top level FuncDef, with the source range and the tokens it
+    was parsed from """
+    __slots__ = ['start', 'end', 'tokens', 'func', 'signature', 'calls', 'valid']
+
+    def __init__(self, start, end, tokens, func):
+        self.start, self.end, self.tokens = start, end, tokens
+        self.set_func(func)
+
+    def set_func(self, func):
+        self.func, self.valid = func, False
+        self.signature = (func.type, tuple(v.type for v in func.args))
+        self.calls = called_names(func)
+
+    def reparse(self):
+        # validate annotates the tree in place, so a function is validated
+        # again from a fresh parse of its tokens
+        self.set_func(next(Parser().parse_functions(self.tokens))[0])
+
+class Incremental:
+    """ A front end that keeps the tokens and the validated FuncDef of
+    every top level function. After an edit only the text between the
+    untouched functions around it is lexed and parsed again, and only the
+    new functions and the callers of those whose signature changed are
+    validated again. The functions are shared with later edits, so the
+    tree should not be optimized in place """
+
+    def __init__(self, code=''):
+        self.code = code
+        self.chunks = []
+        self.stats = Counter()
+        self.rebuild()
+
+    def __repr__(self):
+        return ', '.join('{} {}'.format(v, k) for k, v in sorted(self.stats.items()))
+
+    def root(self):
+        return Root([c.func for c in self.chunks])
+
+    def rebuild(self):
+        self.chunks = self.parse_region(0, len(self.code))
+        self.validate()
+
+    def edit(self, start, end, text):
+        """ Replace code[start:end] with text, and return the new Root """
+        chunks, old_len = self.chunks, len(self.code)
+        self.code = self.code[:start] + text + self.code[end:]
+        delta = len(text) - (end - start)
+        # damaged functions are the ones the edit touches, the text between
+        # the untouched ones around them is parsed again
+        i = 0
+        while i < len(chunks) and chunks[i].end < start:
+            i += 1
+        j = i
+        while j < len(chunks) and chunks[j].start <= end:
+            j += 1
+        while True:
+            region_start = chunks[i - 1].end if i > 0 else 0
+            region_end = chunks[j].start if j < len(chunks) else old_len
+            try:
+                new = self.parse_region(region_start, region_end + delta)
+                break
+            except (TokenizeFailedException, ParseException):
+                # e.g. a brace or a comment left open, which the next
+                # function may close. The region grows geometrically, and
+                # if nothing closes it the next edit starts over from the
+                # whole file
+                if j == len(chunks):
+                    self.chunks = []
+                    raise
+                j = min(len(chunks), j + max(1, j - i))
+        for c in chunks[j:]:
+            c.start += delta
+            c.end += delta
+        old_signatures = {c.func.name: c.signature for c in chunks[i:j]}
+        new_signatures = {c.func.name: c.signature for c in new}
+        changed = {name for name in old_signatures.keys() | new_signatures.keys()
+            if old_signatures.get(name) != new_signatures.get(name)}
+        self.chunks = chunks[:i] + new + chunks[j:]
+        for c in self.chunks:
+            if c.valid and c.calls & changed:
+                c.reparse()
+                self.stats['functions parsed'] += 1
+        self.validate()
+        return self.root()
+
+    def parse_region(self, start, end):
+        spans = list(Tokenizer().spans(self.code, start, end))
+        if spans and spans[-1][1] > end:
+            # e.g. a // comment or a name running into the next function
+            raise ParseException("Function definitions are not separated")
+        spans = [s for s in spans if not isinstance(s[2], COMMENT)]
+        self.stats['chars lexed'] += end - start
+        tokens = tuple(t for _, _, t in spans)
+        chunks = []
+        for func, lo, hi in Parser().parse_functions(tokens):
+            chunks.append(Chunk(spans[lo][0], spans[hi - 1][1], tokens[lo:hi], func))
+        self.stats['functions parsed'] += len(chunks)
+        return chunks
+
+    def validate(self):
+        ctx = Context(0, None, None, {}, {})
+        for c in self.chunks:
+            if c.valid:
+                name = c.func.name
+                if name in ctx.f_map:
+                    raise FunctionDefDuplication(name)
+                ctx.f_map[name] = c.signature
+                continue
+            try:
+                c.func.validate(ctx)
+            except Exception:
+                # half annotated, so start again from the tokens next time
+                c.reparse()
+                raise
+            c.valid = True
+            self.stats['functions validated'] += 1
@@ -1,24 +1,52 @@
+import argparse
 import sys
-from tokenizer import Tokenizer
-from parser import Parser
+import cache
+import frontend
+import optimizer
+from pygen import PyGen
+from vm import BytecodeCompiler, VM
+from tree import Root, Context, Mem
 
 
 def main():
-    code = open(sys.argv[1]).read()
+    arg_parser = argparse.ArgumentParser(description='Interpret a mini-C program')
+    arg_parser.add_argument('file')
+    arg_parser.add_argument('--stream', action='store_true',
+        help='lex, parse and validate the file incrementally')
+    arg_parser.add_argument('--backend', choices=['closure', 'tree', 'py', 'vm'], default='closure',
+        help='run compiled closures (default), walk the syntax tree, run generated python or run bytecode')
+    optimizer.add_arguments(arg_parser)
+    cache.add_arguments(arg_parser)
+    mode = arg_parser.add_mutually_exclusive_group()
+    mode.add_argument('--release', action='store_true',
+        help='trust static validation and skip runtime type checks')
+    mode.add_argument('--debug', action='store_true',
+        help='keep runtime type checks and give every context an id')
+    args = arg_parser.parse_args()
+    Mem.release = args.release
+    Context.debug = args.debug
 
-    # Tokenize
-    T = Tokenizer()
-    tokens = T.tokenize(code)
-
-    # Parse
-    P = Parser()
-    tree = P.parse(tokens)
-
-    # Validate
-    tree.validate()
+    # Tokenize, parse & validate
+    if args.stream:
+        tree = Root(list(frontend.stream(args.file)))
+    else:
+        tree = cache.load_args(args.file, args)
+    tree = optimizer.optimize_args(tree, args)
 
     # Interpret
-    print(tree.evaluate())
+    if args.backend == 'tree':
+        print(tree.evaluate())
+    elif args.backend == 'py':
+        print(PyGen().run(tree))
+    elif args.backend == 'vm':
+        print(VM(BytecodeCompiler().compile(tree)).run())
+    else:
+        print(tree.compile()(Context(0, None, None, {}, {})))
+
+    # only the closure engine and the tree walker use memo tables
+    for f in tree.functions:
+        if f.memo is not None and args.backend in ['closure', 'tree']:
+            print(f.memo, file=sys.stderr)
 
 if __name__ == '__main__':
     main()
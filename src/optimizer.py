@@ -0,0 +1,607 @@
+import copy
+import sys
+
+from collections import Counter
+from tree import *
+from runtime import *
+
+
+def is_pure(e):
+    """ Whether evaluating expression e can't have side effects """
+    if isinstance(e, (Literal, VarRef)):
+        return True
+    if isinstance(e, ArrayRef):
+        return is_pure(e.index)
+    if isinstance(e, ArrayInit):
+        return all(is_pure(v) for v in e.value)
+    if isinstance(e, UnaryOp):
+        return e.op not in UnaryOp.need_ref and is_pure(e.child)
+    if isinstance(e, BinaryOp):
+        # the unsupported operators raise at runtime
+        return (e.op in BinaryOp.funcs or e.op in ['&&', '||']) and \
+            is_pure(e.left) and is_pure(e.right)
+    return False
+
+class Pass:
+    """ An optimization over a validated Root, which may be rewritten in place """
+    name = None
+
+    def __init__(self):
+        self.stats = Counter()
+
+    def run(self, root):
+        raise RuntimeError("Unimplemented optimization pass {}".format(self.name))
+
+    def report(self):
+        return "{}: {}".format(self.name, ', '.join(
+            '{} {}'.format(n, what) for what, n in sorted(self.stats.items())) or 'nothing done')
+
+class Transformer(Pass):
+    """ Rebuild the tree bottom up. visit_<Node> methods get a node whose
+    children are already visited, and return its replacement, or None to
+    drop a statement """
+
+    def run(self, root):
+        return self.visit(root)
+
+    def visit(self, node):
+        for field in node._fields:
+            value = getattr(node, field)
+            if isinstance(value, Tree):
+                setattr(node, field, self.visit(value))
+            elif isinstance(value, list):
+                value[:] = [v for v in (
+                    self.visit(v) if isinstance(v, Tree) else v for v in value) if v is not None]
+        method = getattr(self, 'visit_' + type(node).__name__, None)
+        return node if method is None else method(node)
+
+class ConstantFolding(Transformer):
+    """ Evaluate operators on literals, with the interpreter's semantics,
+    apply algebraic identities and drop branches on constant conditions """
+    name = 'fold'
+
+    def fold(self, node, value):
+        self.stats['folded'] += 1
+        return Literal(node.type, value)
+
+    def simplify(self, node, replacement):
+        self.stats['simplified'] += 1
+        return replacement
+
+    def visit_UnaryOp(self, e):
+        op, child = e.op, e.child
+        if op == '!' and isinstance(child, UnaryOp) and child.op == '!':
+            return self.simplify(e, child.child)
+        if not isinstance(child, Literal):
+            return e
+        v = child.value
+        if op == '+':
+            return self.fold(e, v)
+        if op == '-':
+            return self.fold(e, -v)
+        if op == '!':
+            return self.fold(e, not v)
+        if op == '~':
+            return self.fold(e, UnaryOp.invert(v))
+        return e
+
+    def visit_BinaryOp(self, e):
+        op, left, right = e.op, e.left, e.right
+        l_const, r_const = isinstance(left, Literal), isinstance(right, Literal)
+        if op in ['&&', '||']:
+            if r_const and right.value == (op == '&&'):
+                return self.simplify(e, left)  # x && true, x || false
+            if not l_const:
+                return e
+            # true && x, false || x are x; the other two don't look at x
+            if left.value == (op == '&&'):
+                return self.simplify(e, right)
+            return self.fold(e, left.value)
+        if op not in BinaryOp.funcs:
+            return e
+        if l_const and r_const:
+            if op in ['/', '%'] and right.value == 0:
+                return e  # leave the error to runtime
+            return self.fold(e, BinaryOp.funcs[op](left.value, right.value))
+        if e.type != 'int':
+            return e
+        if r_const:
+            const, other = right.value, left
+        elif l_const:
+            const, other = left.value, right
+        else:
+            return e
+        if (op, const) in [('+', 0), ('*', 1)] or \
+                r_const and (op, const) in [('-', 0), ('/', 1)]:
+            # x + 0, 0 + x, x * 1, 1 * x, x - 0, x / 1
+            return self.simplify(e, other)
+        if const == 0 and op == '*' and is_pure(other):
+            return self.fold(e, 0)
+        return e
+
+    def visit_If(self, st):
+        cond = st.cond
+        if not isinstance(cond, Literal):
+            return st
+        body = st.true_body if cond.value else st.false_body
+        if body is not None and body.defines_functions():
+            return st  # the branch needs its own scope
+        self.stats['branches removed'] += 1
+        return body
+
+    def visit_While(self, st):
+        cond = st.cond
+        if isinstance(cond, Literal) and not cond.value:
+            self.stats['loops removed'] += 1
+            return None
+        return st
+
+def always_returns(st):
+    if isinstance(st, Return):
+        return True
+    if isinstance(st, Block):
+        return any(always_returns(s) for s in st.statements)
+    if isinstance(st, If):
+        return st.false_body is not None and \
+            always_returns(st.true_body) and always_returns(st.false_body)
+    return False
+
+def children(node):
+    for field in node._fields:
+        value = getattr(node, field)
+        if isinstance(value, Tree):
+            yield value
+        elif isinstance(value, list):
+            yield from (v for v in value if isinstance(v, Tree))
+    if isinstance(node, VarDef) and isinstance(node.len, Tree):
+        yield node.len
+
+def walk(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(children(node))
+
+def called_names(node):
+    names, stack = set(), [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, FuncCall):
+            names.add(node.name)
+        stack.extend(children(node))
+    return names
+
+def nested_names(root):
+    """ Names of the functions defined inside other functions """
+    return {n.name for f in root.functions for n in walk(f.body) if isinstance(n, FuncDef)}
+
+class DeadCodeElimination(Transformer):
+    """ Drop functions main never calls, statements after a return, branches
+    on constant conditions and variables that are never read """
+    name = 'dce'
+
+    def __init__(self):
+        super().__init__()
+        self.removed = {'functions': [], 'unused variables': []}
+        self.dead_defs = self.dead_refs = set()
+
+    def run(self, root):
+        if isinstance(root, Root):
+            self.prune_functions(root)
+        while True:
+            done = sum(self.stats.values())
+            self.find_dead_variables(root)
+            root = self.visit(root)
+            if sum(self.stats.values()) == done:
+                return root
+
+    def report(self):
+        s = super().report()
+        for what, names in self.removed.items():
+            if names:
+                s += '\n    {}: {}'.format(what, ', '.join(names))
+        return s
+
+    def prune_functions(self, root):
+        functions = {f.name: f for f in root.functions}
+        if 'main' not in functions:
+            return
+        # names are resolved lexically by validate, so matching on names
+        # keeps too much at worst
+        reachable, todo = set(), ['main']
+        while todo:
+            name = todo.pop()
+            if name in reachable or name not in functions:
+                continue
+            reachable.add(name)
+            todo.extend(called_names(functions[name]))
+        for f in root.functions:
+            if f.name not in reachable:
+                self.stats['functions removed'] += 1
+                self.removed['functions'].append(f.name)
+        root.functions[:] = [f for f in root.functions if f.name in reachable]
+
+    def find_dead_variables(self, root):
+        # a variable is the (function, slot) pair references resolve to
+        defs, reads, writes = {}, set(), {}
+        def scan(node, funcs):
+            if isinstance(node, FuncDef):
+                funcs = funcs + [node]
+                scan(node.body, funcs)
+                return
+            if isinstance(node, Block):
+                for st in node.statements:
+                    if isinstance(st, VarDef):
+                        defs[funcs[st.frame], st.slot] = st
+            if isinstance(node, Assignment):
+                ref = node.ref
+                writes.setdefault((funcs[ref.frame], ref.slot), []).append(ref)
+                if isinstance(ref, ArrayRef):
+                    scan(ref.index, funcs)
+                scan(node.expr, funcs)
+                return
+            if isinstance(node, Reference):
+                reads.add((funcs[node.frame], node.slot))
+            for child in children(node):
+                scan(child, funcs)
+        scan(root, [])
+        dead = [key for key in defs if key not in reads]
+        self.dead_defs = {defs[key] for key in dead}
+        self.dead_refs = {ref for key in dead for ref in writes.get(key, [])}
+
+    def visit_VarDef(self, v):
+        if v not in self.dead_defs:
+            return v
+        if (v.default is not None and not is_pure(v.default)) or \
+                (isinstance(v.len, Tree) and not is_pure(v.len)):
+            return v
+        self.stats['unused variables removed'] += 1
+        self.removed['unused variables'].append(v.name)
+        return None
+
+    def visit_Assignment(self, a):
+        if a.ref not in self.dead_refs:
+            return a
+        self.stats['dead stores removed'] += 1
+        effects = [a.expr] if isinstance(a.ref, VarRef) else [a.expr, a.ref.index]
+        effects = [e for e in effects if not is_pure(e)]
+        # whatever has side effects is kept as expression statements
+        return Block(effects) if effects else None
+
+    def visit_Block(self, block):
+        statements = block.statements
+        for i, st in enumerate(statements):
+            if always_returns(st) and i + 1 < len(statements):
+                self.stats['unreachable statements removed'] += len(statements) - i - 1
+                del statements[i + 1:]
+                break
+        return block
+
+    visit_If = ConstantFolding.visit_If
+    visit_While = ConstantFolding.visit_While
+
+class LoopInvariantCodeMotion(Transformer):
+    """ Compute pure subexpressions of a while loop that only read variables
+    the loop never writes once, into temporaries defined before the loop """
+    name = 'licm'
+
+    # hoisted code runs even when the loop body doesn't, so nothing that
+    # can fail is moved
+    unsafe_ops = ['/', '%']
+
+    def __init__(self):
+        super().__init__()
+        self.funcs = []
+        self.n_temps = 0
+
+    def visit(self, node):
+        if isinstance(node, FuncDef):
+            self.funcs.append(node)
+            node = super().visit(node)
+            self.funcs.pop()
+            return node
+        if isinstance(node, While):
+            # outer loops first, so expressions go as far out as they can
+            hoisted = self.hoist_loop(node)
+            super().visit(node)
+            return hoisted
+        return super().visit(node)
+
+    def hoist_loop(self, loop):
+        if not self.funcs:
+            return loop
+        func, nodes = self.funcs[-1], list(walk(loop))
+        if any(isinstance(n, FuncDef) for n in nodes):
+            return loop
+        # only nested functions can write this function's variables, and a
+        # call can reach a sibling that writes those of the enclosing ones
+        self.calls = any(isinstance(n, FuncCall) for n in nodes)
+        if self.calls and any(isinstance(n, FuncDef) for n in walk(func.body)):
+            return loop
+        self.written = set()
+        for n in nodes:
+            if isinstance(n, Assignment):
+                n = n.ref
+            elif isinstance(n, UnaryOp) and n.op in UnaryOp.need_ref:
+                n = n.child
+            elif not isinstance(n, VarDef):
+                continue
+            self.written.add((n.frame, n.slot))
+        self.func, self.temps = func, []
+        loop.cond = self.hoist(loop.cond)
+        loop.body = self.hoist(loop.body)
+        if not self.temps:
+            return loop
+        self.stats['loops optimized'] += 1
+        return Block(self.temps + [loop])
+
+    def invariant(self, e):
+        for n in walk(e):
+            if isinstance(n, ArrayRef) or (isinstance(n, BinaryOp) and n.op in self.unsafe_ops):
+                return False
+            if isinstance(n, VarRef) and ((n.frame, n.slot) in self.written or
+                    self.calls and n.frame < self.func.level):
+                return False
+        return is_pure(e)
+
+    def hoist(self, node):
+        if isinstance(node, (BinaryOp, UnaryOp)) and node.type in ['int', 'bool'] \
+                and self.invariant(node):
+            return self.temp(node)
+        for field in node._fields:
+            value = getattr(node, field)
+            if isinstance(value, Tree):
+                setattr(node, field, self.hoist(value))
+            elif isinstance(value, list):
+                value[:] = [self.hoist(v) if isinstance(v, Tree) else v for v in value]
+        return node
+
+    def temp(self, e):
+        self.stats['expressions hoisted'] += 1
+        name = '_licm{}'.format(self.n_temps)
+        self.n_temps += 1
+        v = VarDef(name, e.type, e)
+        v.frame, v.slot = self.func.level, self.func.n_slots
+        self.func.n_slots += 1
+        self.temps.append(v)
+        ref = VarRef(name)
+        ref.type, ref.frame, ref.slot = e.type, v.frame, v.slot
+        return ref
+
+def tail_returns(statements):
+    """ Rewrite statements so that any return is the last one to run, which
+    is possible when an if that returns is followed by the rest of the code """
+    for i, st in enumerate(statements):
+        if isinstance(st, Return):
+            del statements[i + 1:]
+            return True
+        if not any(isinstance(n, Return) for n in walk(st)):
+            continue
+        rest = statements[i + 1:]
+        if isinstance(st, Block) and not rest:
+            return tail_returns(st.statements)
+        if not isinstance(st, If):
+            return False
+        if always_returns(st):
+            del statements[i + 1:]
+        elif rest:
+            if st.false_body is not None or not always_returns(st.true_body):
+                return False
+            st.false_body = Block(rest)
+            del statements[i + 1:]
+        return tail_returns(st.true_body.statements) and \
+            (st.false_body is None or tail_returns(st.false_body.statements))
+    return True
+
+def replace_returns(statements, result):
+    """ Replace each return with the statement result(value) makes, or none """
+    out = []
+    for st in statements:
+        if isinstance(st, Return):
+            st = result(st.expr)
+        elif isinstance(st, Block):
+            replace_returns(st.statements, result)
+        elif isinstance(st, If):
+            replace_returns(st.true_body.statements, result)
+            if st.false_body is not None:
+                replace_returns(st.false_body.statements, result)
+        if st is not None:
+            out.append(st)
+    statements[:] = out
+
+class Inliner(Pass):
+    """ Replace statements that call a small non-recursive function, as
+    f(...); x = f(...); int x = f(...); or return f(...); with a copy of
+    its body. The copy's variables get new names and slots in the caller's
+    frame, and its returns become what the statement did with the value """
+    name = 'inline'
+
+    def __init__(self, budget=40):
+        super().__init__()
+        self.budget = budget
+        self.inlined = Counter()
+        self.n_copies = 0
+
+    def report(self):
+        s = super().report()
+        for name, n in sorted(self.inlined.items()):
+            s += '\n    {}: {} call sites'.format(name, n)
+        return s
+
+    def run(self, root):
+        if not isinstance(root, Root):
+            return root
+        functions = self.functions = {f.name: f for f in root.functions}
+        calls = {name: called_names(f) & functions.keys() for name, f in functions.items()}
+        # a nested function could shadow a top level one at a call site
+        nested = nested_names(root)
+        # and one the callee calls could be shadowed at the call site, so
+        # the copy would call another function
+        self.excluded = {'main'} | nested | \
+            {name for name, f in functions.items() if called_names(f) & nested}
+        # callees go before their callers, so what they call is already
+        # inlined; functions on a cycle of calls are never inlined
+        order, done = [], set()
+        def visit(name, path):
+            if name in path:
+                self.excluded.update(path[path.index(name):])
+                return
+            if name in done:
+                return
+            for callee in sorted(calls[name]):
+                visit(callee, path + [name])
+            done.add(name)
+            order.append(name)
+        for name in functions:
+            visit(name, [])
+        for name in order:
+            self.expand(functions[name], functions[name])
+        return root
+
+    def expand(self, node, caller):
+        for child in children(node):
+            self.expand(child, child if isinstance(child, FuncDef) else caller)
+        if isinstance(node, Block):
+            node.statements[:] = [
+                new for st in node.statements for new in self.inline(st, caller)]
+
+    def inline(self, st, caller):
+        keep = []
+        if isinstance(st, FuncCall):
+            call = st
+            result = lambda e: e if e is not None and not is_pure(e) else None
+        elif isinstance(st, Assignment) and isinstance(st.expr, FuncCall):
+            call = st.expr
+            result = lambda e: Assignment(copy.deepcopy(st.ref), st.op, e)
+        elif isinstance(st, VarDef) and isinstance(st.default, FuncCall) and st.len is None:
+            # the value goes to a temporary and the variable is defined
+            # after the copy, so arguments still see a variable it shadows
+            call, keep = st.default, [st]
+            def result(e):
+                return Assignment(self.ref(temp), '=', e)
+        elif isinstance(st, Return) and isinstance(st.expr, FuncCall):
+            call, result = st.expr, Return
+        else:
+            return [st]
+        callee = self.functions.get(call.name)
+        if callee is None or callee.name in self.excluded or \
+                sum(1 for _ in walk(callee.body)) > self.budget or \
+                any(isinstance(n, FuncDef) for n in walk(callee.body)):
+            return [st]
+        args, body = copy.deepcopy((callee.args, callee.body))
+        if not tail_returns(body.statements):
+            return [st]
+        # the copy's variables take fresh slots after the caller's own
+        offset, prefix = caller.n_slots, '_inl{}_'.format(self.n_copies)
+        caller.n_slots += callee.n_slots
+        self.n_copies += 1
+        for n in walk(Block(args + [body])):
+            if isinstance(n, (VarDef, Reference)) and n.frame == callee.level:
+                n.frame, n.slot, n.name = caller.level, n.slot + offset, prefix + n.name
+        for arg, value in zip(args, call.params):
+            arg.default = value
+        if keep:
+            temp = VarDef(prefix + 'result', st.type, None)
+            temp.frame, temp.slot = caller.level, caller.n_slots
+            caller.n_slots += 1
+        replace_returns(body.statements, result)
+        self.stats['calls inlined'] += 1
+        self.inlined[callee.name] += 1
+        if keep:
+            st.default = self.ref(temp)
+            return [temp, Block(args + body.statements)] + keep
+        return [Block(args + body.statements)]
+
+    @staticmethod
+    def ref(v):
+        ref = VarRef(v.name)
+        ref.type, ref.frame, ref.slot = v.type, v.frame, v.slot
+        return ref
+
+class Memoization(Pass):
+    """ Give pure recursive functions a Memo of their results. A function
+    is pure when it takes and returns scalars, uses no arrays, doesn't
+    print and only calls pure functions """
+    name = 'memo'
+
+    def __init__(self, size=1024):
+        super().__init__()
+        self.size = size
+        self.memoized = []
+
+    def report(self):
+        s = super().report()
+        if self.memoized:
+            s += '\n    ' + ', '.join(self.memoized)
+        return s
+
+    def run(self, root):
+        if not isinstance(root, Root):
+            return root
+        functions = {f.name: f for f in root.functions}
+        calls = {name: called_names(f) for name, f in functions.items()}
+        nested = nested_names(root)
+        pure = {name for name, f in functions.items() if name not in nested and self.is_pure(f)}
+        changed = True
+        while changed:
+            impure = {name for name in pure if not calls[name] <= pure}
+            pure -= impure
+            changed = bool(impure)
+        for f in root.functions:
+            if f.name in pure and self.is_recursive(f.name, calls):
+                f.memo = Memo(f.name, self.size)
+                self.stats['functions memoized'] += 1
+                self.memoized.append(f.name)
+        return root
+
+    @staticmethod
+    def is_pure(f):
+        if f.type == 'void' or any(arg.len is not None for arg in f.args):
+            return False
+        for n in walk(f.body):
+            if isinstance(n, (ArrayRef, Printf, FuncDef)) or \
+                    (isinstance(n, VarDef) and n.len is not None):
+                return False
+        return True
+
+    @staticmethod
+    def is_recursive(name, calls):
+        seen, todo = set(), list(calls[name])
+        while todo:
+            callee = todo.pop()
+            if callee == name:
+                return True
+            if callee not in seen and callee in calls:
+                seen.add(callee)
+                todo.extend(calls[callee])
+        return False
+
+PASSES = {p.name: p for p in [
+    ConstantFolding, DeadCodeElimination, LoopInvariantCodeMotion, Inliner, Memoization]}
+
+def optimize(root, names, out=sys.stderr, options={}):
+    """ Run the named passes over root in order, reporting to out. options
+    maps pass names to keyword arguments for them """
+    for name in names:
+        p = PASSES[name](**options.get(name, {}))
+        root = p.run(root)
+        if out is not None:
+            print(p.report(), file=out)
+    return root
+
+def add_arguments(arg_parser):
+    arg_parser.add_argument('-O', '--opt', action='append', default=[],
+        choices=sorted(PASSES),
+        help='run an optimization pass after validation, may be repeated')
+    arg_parser.add_argument('--inline-budget', type=int, default=40,
+        help='largest function body, in tree nodes, the inline pass copies')
+    arg_parser.add_argument('--memo-size', type=int, default=1024,
+        help='results the memo pass keeps per function')
+
+def optimize_args(root, args):
+    """ optimize() with the passes and options add_arguments parsed """
+    return optimize(root, args.opt, options={
+        'inline': {'budget': args.inline_budget},
+        'memo': {'size': args.memo_size}
+    })
@@ -1,24 +1,50 @@
 from collections import namedtuple
+from itertools import islice
 from tokenizer import *
 from tree import *
 from exceptions import *
 from runtime import *
 
 class Parser:
+
+    # when streaming, consumed tokens are dropped from the buffer once the
+    # cursor gets this far into it
+    window = 1024
     
     def parse(self, tokens):
-        self.tokens = tokens
-        tree = self.parse_root()
-        return tree
+        # comments are dropped once, up front
+        self.tokens = tuple(t for t in tokens if not isinstance(t, COMMENT))
+        self.stream = None
+        self.pos = 0
+        return Root(list(self.parse_root()))
+
+    def parse_stream(self, tokens):
+        # Tokens are pulled lazily into a small buffer, and each FuncDef is
+        # yielded as soon as it's complete
+        self.tokens = []
+        self.stream = (t for t in tokens if not isinstance(t, COMMENT))
+        self.pos = 0
+        return self.parse_root()
     
+    def parse_functions(self, tokens):
+        # Unlike parse, anything that isn't a whole FuncDef is an error. Each
+        # FuncDef comes with the range of tokens it was parsed from
+        self.tokens = tuple(t for t in tokens if not isinstance(t, COMMENT))
+        self.stream = None
+        self.pos = 0
+        while self.pos < len(self.tokens):
+            start = self.pos
+            if not self.match_tokens(BASE_TYPE):
+                raise ParseException(
+                    "Expecting a function definition but got '{}'".format(self.peek()))
+            yield self.parse_func_def(), start, self.pos
+
     def parse_root(self):
-        functions = []
         try:
             while self.match_tokens(BASE_TYPE):
-                functions.append(self.parse_func_def())
+                yield self.parse_func_def()
         except UnexpectedEndOfTokenListException:
             pass
-        return Root(functions)
     
     def parse_block(self):
         statements = []
@@ -43,7 +69,7 @@ class Parser:
             if self.match_tokens(ASSIGN_OP):
                 statement = self.parse_assignment(array_ref)
             else:  # should be an expression
-                statement = self.parse_expr([ARRAY_REF(array_ref)])
+                statement = self.parse_expr(array_ref)
         elif self.match_tokens(BASE_TYPE, NAME, O_PAREN):
             return self.parse_func_def()
         elif self.match_tokens(BASE_TYPE, NAME):
@@ -83,24 +109,41 @@ class Parser:
             return Return(self.parse_expr())
         return Return(None)
     
+    def peek(self, i=0):
+        j = self.pos + i
+        if j >= len(self.tokens) and self.stream is not None:
+            self.fill(i + 1)
+            j = self.pos + i
+        return self.tokens[j]
+
+    def fill(self, n):
+        tokens, pos = self.tokens, self.pos
+        if pos >= self.window:
+            del tokens[:pos]
+            self.pos = pos = 0
+        tokens.extend(islice(self.stream, pos + n - len(tokens)))
+
     def consume(self, expected_type=None):
-        self.parse_comment()
-        if not expected_type or isinstance(self.tokens[0], expected_type):
-            return self.tokens.pop(0)
+        t = self.peek()
+        if not expected_type or isinstance(t, expected_type):
+            self.pos += 1
+            return t
         raise ParseException(
             "Expecting token of type '{}' but got '{}'".format(
-                expected_type, type(self.tokens[0])))
+                expected_type, type(t)))
     
-    def match_tokens(self, *argv):
+    def lookahead(self, i=0):
         try:
-            self.parse_comment()
-            for i, _type in enumerate(argv):
-                if not isinstance(self.tokens[i], _type):
-                    return False
-            return True
+            return self.peek(i)
         except IndexError:
             # TODO: add expecting token type to exception message
             raise UnexpectedEndOfTokenListException()
+
+    def match_tokens(self, *argv):
+        for i, _type in enumerate(argv):
+            if not isinstance(self.lookahead(i), _type):
+                return False
+        return True
     
     def parse_args(self):
         args = []
@@ -149,91 +192,72 @@ class Parser:
             default = self.parse_default()
         return VarDef(name, _type, default).set_len(_len)
 
-    def get_postfix(self, postfix=[]):
-        stack = [HASH_OP('#').gen(None)]
-        prev = stack[0]
+    def parse_expr(self, head=None):
+        return self.parse_binary(self.parse_unary(head), 0)
+
+    def parse_binary(self, left, min_prec):
+        # precedence climbing: keep folding in operators that bind tighter
+        # than min_prec, recursing for ones that bind tighter than the last
         while True:
-            if self.match_tokens(NAME) or self.match_tokens(LITERAL):
-                t = self.consume()
-                postfix.append(t)
-                prev = t
-            elif self.match_tokens(O_SQ_BRAC):
-                if isinstance(prev, NAME):
-                    postfix[-1] = ARRAY_REF(self.parse_array_ref(prev.value))
-                else:
-                    raise UnexpectedArrayReference()
-            elif self.match_tokens(O_PAREN):
-                if isinstance(prev, NAME):
-                    # replace previous NAME with FUNC_CALL
-                    postfix[-1] = FUNC_CALL(self.parse_func_call(prev.value))
-                else:
-                    t = self.consume()
-                    t.gen(prev)
-                    stack.append(t)
-                    prev = t
-            elif self.match_tokens(C_PAREN):
-                while not isinstance(stack[-1], O_PAREN):
-                    if isinstance(stack[-1], HASH_OP):
-                        return postfix
-                    postfix.append(stack.pop())
-                stack.pop()  # pop out O_PAREN
-                prev = self.consume()
-            elif self.match_tokens(OP):
-                op = self.consume()
-                op.gen(prev)
-                op_prec, top_prec = op.get_prec(), stack[-1].get_prec()
-                if op_prec > top_prec or (
-                        op_prec == top_prec and op.get_type() == 'LU'):
-                    pass
-                else:
-                    while op_prec <= stack[-1].get_prec():
-                        postfix.append(stack.pop())
-                stack.append(op)
-                prev = op
-            else:
-                break
-        while not isinstance(stack[-1], HASH_OP):
-            postfix.append(stack.pop())
-        return postfix
-    
-    def to_operand(self, t):
-        if isinstance(t, LITERAL):
-            return self.parse_literal_internal(t)
-        if isinstance(t, NAME):
-            if isinstance(t.value, FuncCall) or isinstance(t.value, ArrayRef):
-                return t.value
-            return VarRef(t.value)
-        return t
-    
-    def to_unary_op(self, t):
+            prec = self.next_binary_prec()
+            if prec <= min_prec:
+                return left
+            op = self.consume().value
+            right = self.parse_binary(self.parse_unary(), prec)
+            left = BinaryOp(op, right, left)
+
+    def next_binary_prec(self):
+        t = self.lookahead()
+        if isinstance(t, OP):
+            return OP.binary_prec.get(t.value, 0)
+        return 0
+
+    def parse_unary(self, head=None):
+        operand, paren = head, False
+        if head is None:
+            t = self.lookahead()
+            if isinstance(t, OP) and t.value in OP.left_unary:
+                op = self.consume().value
+                if op in ['++', '--']:
+                    if isinstance(self.lookahead(), CREMENT_OP):
+                        raise ParseException("Unexpected {} after {}".format(
+                            self.peek().value, op))
+                    op = 'L' + op
+                return UnaryOp(op, self.parse_unary())
+            paren = isinstance(t, O_PAREN)
+            operand = self.parse_operand(t)
+        t = self.lookahead()
+        if isinstance(t, O_SQ_BRAC):
+            raise UnexpectedArrayReference()
+        # ++ -- right after an operand are right unary operators, and can't
+        # follow a parenthesized expression or another ++ --
         if isinstance(t, CREMENT_OP):
-            return t.get_type()[0] + t.value
-        return t.value
-    
-    def build_expr(self, postfix):
-        stack = []
-        for t in postfix:
-            if isinstance(t, LITERAL) or isinstance(t, NAME):
-                stack.append(self.to_operand(t))
-            elif isinstance(t, OP):
-                if t.get_type() == 'B':
-                    stack.append(BinaryOp(t.value, stack.pop(), stack.pop()))
-                elif t.get_type() in ['LU', 'RU']:
-                    stack.append(UnaryOp(self.to_unary_op(t), stack.pop()))
-                else:
-                    raise ExpressionParseException(
-                        "Unrecognized operator type {} from operator {}".format(
-                            t.get_type(), t.value))
-            else:
-                raise ExpressionParseException(
-                    "Unexpected token type: {}".format(type(t).__name__))
-        if len(stack) != 1:
-            raise ExpressionParseException(
-                "Unfinished expression parse\n    stack: {}".format(stack))
-        return stack[0]
+            op = self.consume().value
+            if paren:
+                raise ParseException("Unexpected {} after )".format(op))
+            if isinstance(self.lookahead(), CREMENT_OP):
+                raise ParseException("Unexpected {} after {}".format(
+                    self.peek().value, op))
+            operand = UnaryOp('R' + op, operand)
+        return operand
 
-    def parse_expr(self, head=None):
-        return self.build_expr(self.get_postfix([] if head is None else [head]))
+    def parse_operand(self, t):
+        if isinstance(t, LITERAL):
+            return self.parse_literal_internal(self.consume())
+        if isinstance(t, NAME):
+            after = self.lookahead(1)
+            if isinstance(after, O_PAREN):
+                return self.parse_func_call()
+            if isinstance(after, O_SQ_BRAC):
+                return self.parse_array_ref()
+            return self.parse_var_ref()
+        if isinstance(t, O_PAREN):
+            self.consume()
+            expr = self.parse_expr()
+            self.consume(C_PAREN)
+            return expr
+        raise ExpressionParseException(
+            "Unexpected token in expression: {}".format(t))
 
     def parse_func_call(self, name=None):
         if name is None:
@@ -288,11 +312,7 @@ class Parser:
         if isinstance(token, NULL):
             return Literal('null', None)
         raise ParseException("Unrecognized literal {} of token type {}".format(
-            self.tokens[0].value, type(self.tokens[0])))
-
-    def parse_comment(self):
-        while isinstance(self.tokens[0], COMMENT):
-            self.tokens.pop(0)
+            v, type(token)))
 
     def parse_if(self):
         self.consume(IF)
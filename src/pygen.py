@@ -0,0 +1,208 @@
+from tree import *
+from optimizer import is_pure
+from runtime import *
+from exceptions import *
+
+# helpers shared by every generated program
+PRELUDE = '''\
+def _invert(v):
+    C = 2147483648
+    return -(((v + C) % (2*C) - C) + 1)
+
+def _crement(a, i, d, post):
+    v = a[i]
+    a[i] = v + d
+    return v if post else v + d
+
+def _unsupported(op):
+    raise RuntimeError("Operator {} not supported yet".format(op))
+'''
+
+class Function:
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.names = set()  # python names local to this function
+        self.nonlocals = set()  # names of enclosing functions assigned here
+
+class PyGen:
+    """ Translate a validated Root into Python source, one def per FuncDef """
+    unit = ' '*4
+
+    ops = {
+        '/': '//',
+        '&&': 'and',
+        '||': 'or'
+    }
+    unsupported_ops = ['<<', '>>', '&', '^', '|']
+    nil = VarDef.nil
+
+    def gen(self, root):
+        self.lines = []
+        self.scopes = [{}]
+        self.func = None
+        for f in root.functions:
+            self.gen_FuncDef(f, 0)
+            self.lines.append('')
+        return PRELUDE + '\n' + '\n'.join(self.lines)
+
+    def run(self, root):
+        namespace = {}
+        exec(compile(self.gen(root), '<mini-c>', 'exec'), namespace)
+        main = namespace.get('f_main')
+        return main() if main else None
+
+    def emit(self, indent, line):
+        self.lines.append(self.unit * indent + line)
+
+    # names
+
+    def taken(self, py_name):
+        func = self.func
+        while func is not None:
+            if py_name in func.names:
+                return True
+            func = func.parent
+        return False
+
+    def declare(self, name):
+        # every C variable gets its own python name, even when it shadows
+        # another one of the same or an enclosing function
+        py_name, n = 'v_' + name, 0
+        while self.taken(py_name):
+            n += 1
+            py_name = 'v{}_{}'.format(n, name)
+        self.func.names.add(py_name)
+        self.scopes[-1][name] = (py_name, self.func)
+        return py_name
+
+    def lookup(self, name, assign=False):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                py_name, func = scope[name]
+                if assign and func is not self.func:
+                    self.func.nonlocals.add(py_name)
+                return py_name
+        raise UndefinedVariableException(name)
+
+    # statements
+
+    def gen_block(self, block, indent):
+        self.scopes.append({})
+        start = len(self.lines)
+        for st in block.statements:
+            self.gen_statement(st, indent)
+        if len(self.lines) == start:
+            self.emit(indent, 'pass')
+        self.scopes.pop()
+
+    def gen_statement(self, st, indent):
+        method = getattr(self, 'gen_' + type(st).__name__, None)
+        if method is not None:
+            method(st, indent)
+        elif isinstance(st, UnaryOp) and st.op[0] in 'RL':
+            # value is dropped, so ++/-- can be a plain augmented assignment
+            self.emit(indent, '{} {}= 1'.format(self.ref(st.child, True), st.op[1]))
+        else:
+            self.emit(indent, self.expr(st))
+
+    def gen_FuncDef(self, f, indent):
+        self.func = Function(self.func)
+        self.scopes.append({})
+        args = [self.declare(arg.name) for arg in f.args]
+        self.emit(indent, 'def f_{}({}):'.format(f.name, ', '.join(args)))
+        header = len(self.lines)
+        self.gen_block(f.body, indent + 1)
+        if self.func.nonlocals:
+            self.lines.insert(header, self.unit * (indent + 1) +
+                'nonlocal ' + ', '.join(sorted(self.func.nonlocals)))
+        self.scopes.pop()
+        self.func = self.func.parent
+
+    def gen_Block(self, block, indent):
+        self.gen_block(block, indent)
+
+    def gen_VarDef(self, v, indent):
+        _len, default = v.len, v.default
+        if default != None:
+            value = self.expr(default)
+        elif _len is None:
+            value = repr(self.nil[v.type])
+        else:
+            size = self.expr(_len) if isinstance(_len, Tree) else str(_len)
+            value = '[{!r}] * {}'.format(self.nil[v.type], size)
+        self.emit(indent, '{} = {}'.format(self.declare(v.name), value))
+
+    def gen_Assignment(self, a, indent):
+        op = a.op if a.op != '/=' else '//='
+        value = self.expr(a.expr)
+        if op != '=' and isinstance(a.ref, ArrayRef) and \
+                not (is_pure(a.ref.index) and is_pure(a.expr)):
+            # python computes the index of a[i] += v first
+            self.emit(indent, '_value = ' + value)
+            value = '_value'
+        self.emit(indent, '{} {} {}'.format(self.ref(a.ref, True), op, value))
+
+    def gen_Return(self, r, indent):
+        if r.expr == None:
+            self.emit(indent, 'return')
+        else:
+            self.emit(indent, 'return ' + self.expr(r.expr))
+
+    def gen_If(self, st, indent):
+        self.emit(indent, 'if {}:'.format(self.expr(st.cond)))
+        self.gen_block(st.true_body, indent + 1)
+        if st.false_body != None:
+            self.emit(indent, 'else:')
+            self.gen_block(st.false_body, indent + 1)
+
+    def gen_While(self, st, indent):
+        self.emit(indent, 'while {}:'.format(self.expr(st.cond)))
+        self.gen_block(st.body, indent + 1)
+
+    def gen_Printf(self, p, indent):
+        values = ''.join(self.expr(v) + ', ' for v in p.params)
+        self.emit(indent, "print({} % ({}), end='')".format(self.expr(p.format), values))
+
+    # expressions
+
+    def ref(self, ref, assign=False):
+        name = self.lookup(ref.name, assign)
+        if isinstance(ref, ArrayRef):
+            return '{}[{}]'.format(name, self.expr(ref.index))
+        return name
+
+    def expr(self, e):
+        if isinstance(e, Literal):
+            return repr(e.value)
+        if isinstance(e, Reference):
+            return self.ref(e)
+        if isinstance(e, FuncCall):
+            return 'f_{}({})'.format(e.name, ', '.join(self.expr(p) for p in e.params))
+        if isinstance(e, ArrayInit):
+            return '[{}]'.format(', '.join(self.expr(v) for v in e.value))
+        if isinstance(e, BinaryOp):
+            if e.op in self.unsupported_ops:
+                return '_unsupported({!r})'.format(e.op)
+            return '({} {} {})'.format(
+                self.expr(e.left), self.ops.get(e.op, e.op), self.expr(e.right))
+        if isinstance(e, UnaryOp):
+            return self.unary(e)
+        raise CodeGenException("Unexpected expression {}".format(type(e).__name__))
+
+    def unary(self, e):
+        op, child = e.op, e.child
+        if op in ['+', '-']:
+            return '({}{})'.format(op, self.expr(child))
+        if op == '!':
+            return '(not {})'.format(self.expr(child))
+        if op == '~':
+            return '_invert({})'.format(self.expr(child))
+        d, post = 1 if op[1] == '+' else -1, op[0] == 'R'
+        if isinstance(child, ArrayRef):
+            return '_crement({}, {}, {}, {})'.format(
+                self.lookup(child.name), self.expr(child.index), d, post)
+        name = self.lookup(child.name, True)
+        if post:
+            return '(({} := {} + {}) - {})'.format(name, name, d, d)
+        return '({} := {} + {})'.format(name, name, d)
@@ -1,12 +1,12 @@
 import re
 import utils
 
-from tree import Tree
-from collections import namedtuple
+from tree import Tree, Literal, Mem, NEXT, node
 from exceptions import *
 
 # statement but not expression
 class Runtime(Tree):
+    __slots__ = ()
 
     @classmethod
     def parse(cls, name, params):
@@ -14,7 +14,8 @@ class Runtime(Tree):
             return Printf(params[0], params[1:])
         raise UnimplementedRuntimeException(name)
 
-class Printf(namedtuple('Printf', ['format', 'params']), Runtime):
+class Printf(node('Printf', ['format', 'params']), Runtime):
+    __slots__ = ()
 
     type_map = {
         '%i': 'int',
@@ -28,17 +29,36 @@ class Printf(namedtuple('Printf', ['format', 'params']), Runtime):
         for p in self.params:
             p.validate(ctx)
         utils.check_type('string', self.format.type)
-        # TODO: move type check for value render to here instead of throw runtime error
+        if isinstance(self.format, Literal):
+            self.check_holes(self.format.value)
 
-    def evaluate(self, ctx):
+    def check_holes(self, _format):
         # only support %d, %i for integer, %c for character and %s for string
-        _format = self.format.evaluate(ctx)
         holes = re.findall(r'%[dics]', _format)
         params = self.params
         if len(holes) != len(params):
             raise WrongNumberOfArguments('printf', len(holes) + 1, len(params) + 1)
         for i in range(len(holes)):
             utils.check_type(self.type_map[holes[i]], params[i].type)
-        values = [p.evaluate(ctx) for p in params]
+
+    def evaluate(self, ctx):
+        _format = self.format.evaluate(ctx)
+        if not (isinstance(self.format, Literal) or Mem.release):
+            self.check_holes(_format)
+        values = [p.evaluate(ctx) for p in self.params]
         print(_format % tuple(values), end='')
         return None
+
+    def compile_statement(self):
+        _format, params = self.format.compile(), [p.compile() for p in self.params]
+        if isinstance(self.format, Literal) or Mem.release:
+            # checked by validate, or not at all
+            check_holes = lambda f: None
+        else:
+            check_holes = self.check_holes
+        def run(ctx):
+            f = _format(ctx)
+            check_holes(f)
+            print(f % tuple([p(ctx) for p in params]), end='')
+            return NEXT
+        return run
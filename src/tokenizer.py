@@ -1,3 +1,5 @@
+import mmap
+import os
 import re
 from collections import namedtuple
 from exceptions import *
@@ -12,6 +14,14 @@ class Token:
     def __str__(self):
         return "[{}]('{}')".format(type(self).__name__, self.value)
 
+    def __eq__(self, other):
+        if isinstance(other, Token):
+            return type(self) is type(other) and self.value == other.value
+        return self.value == other
+
+    def __hash__(self):
+        return hash(self.value)
+
 class LITERAL(Token):
     pass
 
@@ -22,6 +32,8 @@ class STRING(LITERAL):
 class CHARACTER(LITERAL):
     reg = r'\'\\0\'|\'\\\\\'|\'\\n\'|\'\\t\'|\'[^\n\\]?\''
     token_type = 'CHARACTER'
+    # lexing bytes, the character is one UTF-8 sequence
+    byte_reg = reg.replace(r'[^\n\\]?', r'(?:[^\n\\\x80-\xff]|[\xc0-\xf7][\x80-\xbf]{1,3})?')
 
 class NUMERIC(LITERAL):
     reg = r'\b[0-9]+\b'
@@ -61,57 +73,22 @@ class RUNTIME(Token):
 
 class OP(Token):
 
-    # (
-    #   oprator_values_iterable,
-    #   precedence,  # i.e. operator priority
-    #   type, # B: binary, LU: left-unary, RU: right-unary 
-    # )
-    info_map = [
-        ('()#', 0, None),
-        # (['++', '--'], 20, 'RU),  # save for special handling
-        ('!~', 19, 'LU'),
-        ('*/%', 18, 'B'),
-        # ('+-', 17, 'B'),  # save for special handling
-        (['<<', '>>'], 16, 'B'),
-        (['>', '<', '>=', '<='], 15, 'B'),
-        (['==', '!='], 14, 'B'),
-        ('&', 13, 'B'),
-        ('^', 12, 'B'),
-        ('|', 11, 'B'),
-        (['&&'], 10, 'B'),
-        (['||'], 9, 'B')
-    ]
-    prec = None
-    _type = None
-
-    def __str__(self):
-        return "[{}]({}, {}, {})".format(type(self).__name__, self.value, self.prec, self._type)
-
-    def get_prec(self):
-        if self.prec is None:
-            raise ParseException(
-                "Trying to get precedence of operator '{}' before generation".format(
-                    self.value))
-        return self.prec
-
-    def get_type(self):
-        if self._type is None:
-            raise ParseException(
-                "Trying to get type of operator '{}' before generation".format(
-                    self.value))
-        return self._type
-
-    def gen(self, prev):
-        for ops, prec, _type in OP.info_map:
-            if self.value in ops:
-                self.prec = prec
-                self._type = _type
-                return self
-        raise ParseException("Cannot generate info of operator '{}'".format(self.value))
-
-# fake operator for expression parse
-class HASH_OP(OP):
-    pass
+    # Precedence (i.e. operator priority) of binary operators, all of which
+    # are left associative. Left unary operators (!, ~, +, -, ++, --) bind
+    # at 19, tighter than any of these, and right unary ++, -- at 20.
+    binary_prec = {
+        '*': 18, '/': 18, '%': 18,
+        '+': 17, '-': 17,
+        '<<': 16, '>>': 16,
+        '>': 15, '<': 15, '>=': 15, '<=': 15,
+        '==': 14, '!=': 14,
+        '&': 13,
+        '^': 12,
+        '|': 11,
+        '&&': 10,
+        '||': 9
+    }
+    left_unary = {'!', '~', '+', '-', '++', '--'}
 
 class O_PAREN(OP):
     reg = r'\('
@@ -146,39 +123,14 @@ class S_COMMENT(COMMENT):
 
 class M_COMMENT(COMMENT):
     # ref: https://stackoverflow.com/questions/13014947/regex-to-match-a-c-style-multiline-comment
-    reg = r'(?s)/\*.*?\*/'
+    # DOTALL is scoped to this pattern since it gets embedded in Tokenizer.pattern
+    reg = r'(?s:/\*.*?\*/)'
     token_type = 'M_COMMENT'
 
 class CREMENT_OP(OP):
     reg = r'\+\+|--'
     token_type = 'CREMENT_OP'
 
-    # ++ -- have the highest precedence and complex occurrence limit
-    # Can be after:
-    #     Any operand (as right unary operator): a, 12, ... 
-    #         (actually should be just variable or function call,
-    #         but we'll leave that to typecheck)
-    #     Any binary operator (as left unary operator): +, *, ...
-    #     Any left unary operator except ++, -- (as left unary operator): !, ...
-    #     O_PAREN (as left unary operator)
-    # Cannot be after:
-    #     Any right unary operator
-    #         (which seems to be nothing but ++ and -- themselves)
-    #     ++, --
-    #     C_PAREN
-    #         (only case that it might work is redundant parentheses over variable,
-    #         which will be ignored for now)
-
-    def gen(self, prev):
-        if prev.value in ['++', '--', ')']:
-            raise ParseException("Unexpected {} after {}".format(self.value, prev.value))
-        if not isinstance(prev, OP):
-            self.prec = 20
-            self._type = 'RU'
-            return
-        self.prec = 19
-        self._type = 'LU'
-
 class BITWISE_OP(OP):
     pass
 
@@ -221,23 +173,6 @@ class PLUS_MINUS_OP(ARITH_OP):
     reg = r'\+|-'
     token_type = 'PLUS_MINUS_OP'
 
-    # Binary operator:
-    #   after any operand
-    #   after C_RARAN
-    # Left-unary operator:
-    #   after any operator
-    #   after O_PAREN 
-    def gen(self, prev):
-        if isinstance(prev, OP) and not (
-                isinstance(prev, C_PAREN) or 
-                prev.get_type() == 'RU'):
-            self.prec = 19
-            self._type = 'LU'
-        else:
-            self.prec = 17
-            self._type = 'B'
-
-
 class COMMA(Token):
     reg = r','
     token_type = 'COMMA'
@@ -250,12 +185,6 @@ class NAME(Token):
     reg = r'\b[a-zA-Z_][a-zA-Z0-9_]*\b'
     token_type = 'NAME'
 
-class FUNC_CALL(NAME):
-    pass
-
-class ARRAY_REF(NAME):
-    pass
-
 class Tokenizer:
 
     # TODO: float double
@@ -299,21 +228,59 @@ class Tokenizer:
         NAME
     ]
 
+    # All token patterns joined into one alternation. Alternatives are tried
+    # left to right, so the order of token_list still decides priority.
+    pattern = re.compile('|'.join(
+        '(?P<{}>{})'.format(t.__name__, t.reg) for t in token_list))
+    classes = {t.__name__: t for t in token_list}
+    space = re.compile(r'\s*')
+
+    # the same alternation for lexing bytes, e.g. a memory-mapped file
+    byte_pattern = re.compile(pattern.pattern.replace(CHARACTER.reg, CHARACTER.byte_reg).encode())
+    byte_space = re.compile(space.pattern.encode())
+
     def tokenize(self, code):
-        tokens = []
-        self.code = code
-        while self.code.strip():
-            # print(tokens)
-            tokens.append(self.tokenize_one())
-        return tokens
-
-    def tokenize_one(self):
-        self.code = self.code.strip()
-        for token_class in self.token_list:
-            # print(reg)
-            match = re.match(token_class.reg, self.code)
-            if match != None:
-                match_str = match.group()
-                self.code = self.code[len(match_str):]
-                return token_class(match_str)
-        raise TokenizeFailedException("Tokenize failed at\n" + self.code)
+        return list(self.scan(code))
+
+    def scan(self, code):
+        if isinstance(code, str):
+            match, skip, decode = self.pattern.match, self.space.match, None
+        else:
+            match, skip, decode = self.byte_pattern.match, self.byte_space.match, bytes.decode
+        classes = self.classes
+        pos, end = 0, len(code)
+        while True:
+            pos = skip(code, pos).end()
+            if pos == end:
+                return
+            m = match(code, pos)
+            if m is None:
+                c = code[pos] if decode is None else chr(code[pos])
+                raise TokenizeFailedException("Unrecognized charactor {}".format(c))
+            value = m.group()
+            yield classes[m.lastgroup](value if decode is None else decode(value))
+            pos = m.end()
+
+    def spans(self, code, pos=0, end=None):
+        # like scan, for a str, but each token comes with its offsets and
+        # lexing stops at end. The last token is matched as a whole, so a
+        # comment or a name may run past end
+        match, skip, classes = self.pattern.match, self.space.match, self.classes
+        end = len(code) if end is None else end
+        while pos < end:
+            pos = skip(code, pos, end).end()
+            if pos == end:
+                return
+            m = match(code, pos)
+            if m is None:
+                raise TokenizeFailedException("Unrecognized charactor {}".format(code[pos]))
+            yield pos, m.end(), classes[m.lastgroup](m.group())
+            pos = m.end()
+
+    def scan_file(self, path):
+        with open(path, 'rb') as f:
+            # mmap refuses empty files
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as code:
+                yield from self.scan(code)
@@ -13,29 +13,84 @@
 --------------------/ ,  . \--------._
 """
 
+import itertools
+import operator
 import utils
 
-from collections import namedtuple
-from random import randint
+from array import array
+from collections import OrderedDict
+from functools import partial
 from exceptions import *
 
 
+class CharArray(array):
+    """ A char array, one code point per element """
+    __slots__ = ()
+    _get = array.__getitem__
+    _set = array.__setitem__
+
+    def __new__(cls, values=()):
+        return array.__new__(cls, 'I', values)
+
+    def __getitem__(self, i):
+        return chr(self._get(i))
+
+    def __setitem__(self, i, v):
+        self._set(i, ord(v))
+
+class BoolArray(bytearray):
+    """ A bool array, one byte per element """
+    __slots__ = ()
+    _get = bytearray.__getitem__
+
+    def __getitem__(self, i):
+        return self._get(i) == 1
+
 class Mem:
 
+    # release mode trusts validate and skips runtime type checks
+    release = False
+
+    # C arrays are kept unboxed: 8 bytes per int, 4 per char, 1 per bool
+    storage = {
+        'int': lambda values: array('q', values),
+        'char': lambda values: CharArray(map(ord, values)),
+        'bool': BoolArray
+    }
+    storage_types = {'int': array, 'char': CharArray, 'bool': BoolArray}
+
     def __init__(self, _type, value):
         self.type = _type
         if isinstance(value, list):
+            value = self.store(_type, value)
+        if isinstance(value, (array, bytearray)):
             self.len = len(value)
         else:
             self.len = None
         self.value = value
 
+    @classmethod
+    def store(cls, _type, values):
+        try:
+            return cls.storage[_type](values)
+        except OverflowError:
+            raise RuntimeError("Int array elements are 64 bit, got {}".format(
+                max(values, key=abs)))
+
+    @classmethod
+    def new_array(cls, _type, size):
+        if _type == 'int':
+            return array('q', bytes(8 * size))
+        if _type == 'char':
+            return CharArray([ord(VarDef.nil['char'])] * size)
+        return BoolArray(size)
+
     def __repr__(self):
         return "M({}, {}, {})".format(self.type, self.len, self.value)
 
     def check_type(self, v):
         _type, _len = self.type, self.len
-        if _len == None or (not isinstance(v, list)):
+        if _len == None or (not isinstance(v, (list, array, bytearray))):
             if _type in ['int', 'bool']:
                 if _type != type(v).__name__:
                     raise RuntimeError("Type mismatch, expecting {} but got {}".format(
@@ -46,6 +101,11 @@ class Mem:
                         _type, type(v).__name__))
             else:
                 raise RuntimeError("Unexpected type {}".format(_type))
+        elif not isinstance(v, list):
+            # typed storage can only hold values of its type
+            if type(v) is not self.storage_types[_type]:
+                raise RuntimeError("Type mismatch, expecting {} array but got {}".format(
+                    _type, type(v).__name__))
         else:
             if _type in ['int', 'bool']:
                 if any(_type != type(i).__name__ for i in v):
@@ -59,24 +119,89 @@ class Mem:
                 raise RuntimeError("Unexpected type {}".format(_type))
 
     def put(self, v, i=None):
-        self.check_type(v)
+        if not self.release:
+            self.check_type(v)
+        self.set(v, i)
+
+    def set(self, v, i=None):
         if i is None:
+            if isinstance(v, list):
+                v = self.store(self.type, v)
             self.value = v
         else:
-            self.value[i] = v
+            try:
+                self.value[i] = v
+            except OverflowError:
+                raise RuntimeError("Int array elements are 64 bit, got {}".format(v))
+
+    @classmethod
+    def writer(cls):
+        # for compiled code: skip the release check when writing
+        return cls.set if cls.release else cls.put
 
     def get(self, i=None):
         if i is None:
             return self.value
         return self.value[i]
 
+class Memo:
+    """ Results of a pure function by arguments, dropping the least
+    recently used once there are more than size of them """
+
+    def __init__(self, name, size=1024):
+        self.name = name
+        self.size = size
+        self.table = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def __repr__(self):
+        return "{}: {} hits, {} misses, {} evictions, {}/{} entries".format(
+            self.name, self.hits, self.misses, self.evictions, len(self.table), self.size)
+
+    def call(self, f, ctx, params):
+        table, key = self.table, tuple(params)
+        if key in table:
+            self.hits += 1
+            table.move_to_end(key)
+            return table[key]
+        self.misses += 1
+        v = table[key] = f(ctx, params)
+        if len(table) > self.size:
+            table.popitem(last=False)
+            self.evictions += 1
+        return v
+
 class ReturnValue:
 
     def __init__(self, v):
         self.v = v
 
-class Context(namedtuple('Context', ['id', 'type', 'parent', 'v_map', 'f_map'])):
-    returned = False
+# Compiled statements return NEXT when execution falls through to the next
+# statement, and the function's return value otherwise
+NEXT = object()
+
+# frames holds the variable slots of the running function, preceded by those
+# of the functions it is nested in. validate resolves every variable to a
+# (frame, slot) pair, so the runtime never looks variables up by name.
+class Context:
+    __slots__ = ['id', 'type', 'parent', 'v_map', 'f_map', 'frames',
+                 'returned', 'level', 'n_slots']
+
+    # when set, contexts get sequential ids naming the function they belong to
+    debug = False
+    ids = itertools.count()
+
+    def __init__(self, _id, _type, parent, v_map, f_map, frames=()):
+        self.id = _id
+        self.type = _type
+        self.parent = parent
+        self.v_map = v_map
+        self.f_map = f_map
+        self.frames = frames
+        # used by validate only
+        self.returned = False
+        self.level = 0
+        self.n_slots = 0
     
     def __repr__(self):
         return "C({}, {} , {}, {}, {})".format(
@@ -93,6 +218,9 @@ class Context(namedtuple('Context', ['id', 'type', 'parent', 'v_map', 'f_map']))
         if c is None:
             raise UndefinedVariableException(name)
         return c.v_map[name]
+
+    def get_slot(self, node):
+        return self.frames[node.frame][node.slot]
     
     def get_func(self, name):
         c = self
@@ -102,22 +230,55 @@ class Context(namedtuple('Context', ['id', 'type', 'parent', 'v_map', 'f_map']))
             raise UndefinedFunctionException(name)
         return c.f_map[name]
     
-    def get_return_target(self):
+    def get_frame(self):
         c = self
         while c != None and c.type is None:
             c = c.parent
+        return c
+
+    def get_return_target(self):
+        c = self.get_frame()
         if c is None:
             raise UnexpectedReturnException()
         return c
+
+    def new_slot(self):
+        frame = self.get_return_target()
+        frame.n_slots += 1
+        return frame.level, frame.n_slots - 1
     
     @classmethod
-    def new(cls, _type, parent, name=""):
-        _id = "{}_{}".format(name, randint(1, 10000))
-        return Context(_id, _type, parent, {}, {})
+    def new(cls, _type, parent, name="", frames=None):
+        _id = "{}_{}".format(name, next(cls.ids)) if cls.debug else None
+        if frames is None:
+            frames = parent.frames if parent else ()
+        return Context(_id, _type, parent, {}, {}, frames)
+
+
+def node(name, fields, annotations=()):
+    """ Base class for a tree node, like namedtuple(name, fields) but with
+    __slots__, which also hold the annotations validate adds to the node """
+    fields, annotations = tuple(fields), tuple(annotations)
+    lines = ['def __init__(self, {}):'.format(', '.join(fields))]
+    lines += ['    self.{0} = {0}'.format(f) for f in fields]
+    lines += ['    self.{} = None'.format(a) for a in annotations]
+    namespace = {}
+    exec('\n'.join(lines), namespace)
+
+    def __repr__(self):
+        return '{}({})'.format(name, ', '.join(
+            '{}={!r}'.format(f, getattr(self, f)) for f in fields))
 
+    return type(name, (), {
+        '__slots__': fields + annotations,
+        '_fields': fields,
+        '__init__': namespace['__init__'],
+        '__repr__': __repr__
+    })
 
 class Tree:
     """ This is an interface"""
+    __slots__ = ()
     unit = ' '*3
     extra_fields = []
     
@@ -148,14 +309,29 @@ class Tree:
     def evaluate(self, ctx):
         raise RuntimeError("Unimplemented evaluation function on {}".format(self))
 
+    # compile() turns a validated node into a closure over the runtime
+    # context, compile_statement() into one following the NEXT protocol
+
+    def compile(self):
+        raise RuntimeError("Unimplemented compile function on {}".format(self))
+
+    def compile_statement(self):
+        f = self.compile()
+        def run(ctx):
+            f(ctx)
+            return NEXT
+        return run
+
 class Typable(Tree):
+    __slots__ = ()
     type = None
     extra_fields = ['type']
 
 class Expr(Tree):
-    pass
+    __slots__ = ()
 
-class Root(namedtuple('Root', ['functions']), Tree):
+class Root(node('Root', ['functions']), Tree):
+    __slots__ = ()
     
     def validate(self, ctx=Context(0, None, None, {}, {})):
         for f in self.functions:
@@ -167,7 +343,18 @@ class Root(namedtuple('Root', ['functions']), Tree):
                 return f.evaluate(ctx)
             f.register(ctx)
 
-class FuncDef(namedtuple('FuncDef', ['type', 'name', 'args', 'body']), Tree):
+    def compile(self):
+        functions = [(f.name, f.compile()) for f in self.functions]
+        def run(ctx):
+            for name, f in functions:
+                if name == 'main':
+                    return f(ctx, [])
+                ctx.f_map[name] = partial(f, ctx)
+        return run
+
+class FuncDef(node('FuncDef', ['type', 'name', 'args', 'body'],
+        ['level', 'n_slots', 'memo']), Tree):
+    __slots__ = ()
     
     def validate(self, ctx):
         name, _type = self.name, self.type
@@ -175,6 +362,8 @@ class FuncDef(namedtuple('FuncDef', ['type', 'name', 'args', 'body']), Tree):
             raise FunctionDefDuplication(name)
         ctx.f_map[name] = (_type, [v.type for v in self.args])
         new_ctx = Context.new(_type, ctx, name)
+        outer = ctx.get_frame()
+        new_ctx.level = outer.level + 1 if outer else 0
         if name == 'main' and len(self.args) != 0:
             raise WrongNumberOfArguments(name, 0, len(self.args))
         for v in self.args:
@@ -184,30 +373,76 @@ class FuncDef(namedtuple('FuncDef', ['type', 'name', 'args', 'body']), Tree):
         self.body.validate(new_ctx)
         if _type != 'void' and not new_ctx.returned:
             raise UnreturnedFunctionException(name)
+        self.level, self.n_slots = new_ctx.level, new_ctx.n_slots
 
     def register(self, ctx):
         ctx.f_map[self.name] = self
 
+    def new_frame(self, ctx):
+        frames = ctx.frames[:self.level] + ([None] * self.n_slots,)
+        return Context.new(self.type, ctx, self.name, frames)
+
     def evaluate(self, ctx, params=[]):
-        new_ctx = Context.new(self.type, ctx, self.name)
+        if self.memo is not None:
+            return self.memo.call(self.invoke, ctx, params)
+        return self.invoke(ctx, params)
+
+    def invoke(self, ctx, params):
+        new_ctx = self.new_frame(ctx)
         assert len(params) == len(self.args)
         for i, arg in enumerate(self.args):
             arg.evaluate(new_ctx)
-            var_ref = VarRef(arg.name)
-            a = Assignment(var_ref, '=', params[i])
-            a.evaluate(new_ctx)
-        return self.body.evaluate(new_ctx).v
-
-class Literal(namedtuple('Literal', ['type', 'value']), Expr):
+            new_ctx.get_slot(arg).put(params[i])
+        rtn = self.body.evaluate(new_ctx)
+        return None if rtn is None else rtn.v
+
+    def compile(self):
+        _type, name, body = self.type, self.name, self.body.compile_statement()
+        level, n_slots = self.level, self.n_slots
+        # arguments take the first slots
+        args = [arg.type for arg in self.args]
+        checked = not Mem.release
+        # ctx is where the function was defined, which its body sees
+        def call(ctx, params):
+            slots = [None] * n_slots
+            for i, v in enumerate(params):
+                mem = slots[i] = Mem(args[i], v)
+                if checked:
+                    mem.check_type(v)
+            if Context.debug:
+                new_ctx = Context.new(_type, ctx, name, ctx.frames[:level] + (slots,))
+            else:
+                new_ctx = Context(None, _type, ctx, None, {}, ctx.frames[:level] + (slots,))
+            v = body(new_ctx)
+            return None if v is NEXT else v
+        if self.memo is not None:
+            memo_call, compute = self.memo.call, call
+            call = lambda ctx, params: memo_call(compute, ctx, params)
+        return call
+
+    def compile_statement(self):
+        name, call = self.name, self.compile()
+        def run(ctx):
+            ctx.f_map[name] = partial(call, ctx)
+            return NEXT
+        return run
+
+class Literal(node('Literal', ['type', 'value']), Expr):
+    __slots__ = ()
 
     def evaluate(self, ctx):
         return self.value
 
-class ArrayInit(namedtuple('ArrayInit', ['len', 'value']), Typable):
+    def compile(self):
+        v = self.value
+        return lambda ctx: v
+
+class ArrayInit(node('ArrayInit', ['len', 'value'], ['type']), Typable):
+    __slots__ = ()
 
     def validate(self, ctx):
-        for i in self.len:
-            self.value[i].validate(ctx)
+        for v in self.value:
+            v.validate(ctx)
         _type= self.value[0].type
         if not all(v.type == _type for v in self.value):
             raise ValidationException("Values of different types are in the same array")
@@ -216,7 +451,13 @@ class ArrayInit(namedtuple('ArrayInit', ['len', 'value']), Typable):
     def evaluate(self, ctx):
         return [v.evaluate(ctx) for v in self.value]
 
-class VarDef(namedtuple('VarDef', ['name', 'type', 'default']), Tree):
+    def compile(self):
+        values = [v.compile() for v in self.value]
+        return lambda ctx: [v(ctx) for v in values]
+
+class VarDef(node('VarDef', ['name', 'type', 'default'],
+        ['len', 'frame', 'slot']), Tree):
+    __slots__ = ()
 
     extra_fields = ['len']
 
@@ -237,8 +478,8 @@ class VarDef(namedtuple('VarDef', ['name', 'type', 'default']), Tree):
             utils.check_type('int', _len.type)
             if isinstance(_len, Literal):
                 l = int(_len.value)
-                if self.default != None and l < len(self.default):
-                    raise ArrayInitializeException(self.name, l, len(self.default))
+                if isinstance(self.default, ArrayInit) and l < self.default.len:
+                    raise ArrayInitializeException(self.name, l, self.default.len)
                 self.len = l
     
     def validate(self, ctx):
@@ -254,15 +495,16 @@ class VarDef(namedtuple('VarDef', ['name', 'type', 'default']), Tree):
                 if _len == '*':
                     raise ArrayTypeException(name)
                 self.validate_len(ctx)
-            elif isinstance(default, list):
-                for expr in default:
-                    expr.validate(ctx)
-                    utils.check_type(_type, expr.type)
+            else:
+                default.validate(ctx)
+                utils.check_type(_type, default.type)
                 if _len == '*':
-                    self.len = len(default)
+                    if isinstance(default, ArrayInit):
+                        self.len = default.len
                 else:
                     self.validate_len(ctx)
-        ctx.v_map[name] = (_type, _len is not None)
+        self.frame, self.slot = ctx.new_slot()
+        ctx.v_map[name] = (_type, _len is not None, self.frame, self.slot)
         return default != None
     
     def evaluate(self, ctx):
@@ -270,16 +512,37 @@ class VarDef(namedtuple('VarDef', ['name', 'type', 'default']), Tree):
         if self.default != None:
             default_value = self.default.evaluate(ctx)
         else:
-            if self.len == None:
+            _len = self.len
+            if _len == None:
                 default_value = self.nil[self.type]
             else:
-                default_value = [self.nil[self.type] for i in range(self.len)]
-        ctx.v_map[self.name] = Mem(self.type, default_value)
+                if isinstance(_len, Tree):
+                    _len = _len.evaluate(ctx)
+                default_value = Mem.new_array(self.type, _len)
+        ctx.frames[self.frame][self.slot] = Mem(self.type, default_value)
+
+    def compile_statement(self):
+        frame, slot, _type, _len = self.frame, self.slot, self.type, self.len
+        if self.default != None:
+            default = self.default.compile()
+        elif _len is None:
+            nil = self.nil[_type]
+            default = lambda ctx: nil
+        else:
+            # length only known at runtime
+            size = _len.compile() if isinstance(_len, Tree) else lambda ctx: _len
+            new_array = Mem.new_array
+            default = lambda ctx: new_array(_type, size(ctx))
+        def run(ctx):
+            ctx.frames[frame][slot] = Mem(_type, default(ctx))
+            return NEXT
+        return run
 
 class Operator(Typable, Expr):
-    pass
+    __slots__ = ()
 
-class UnaryOp(namedtuple('UnaryOp', ['op', 'child']), Operator):
+class UnaryOp(node('UnaryOp', ['op', 'child'], ['type']), Operator):
+    __slots__ = ()
     type_map = {
         '+': ['int'],
         '-': ['int'],
@@ -312,7 +575,7 @@ class UnaryOp(namedtuple('UnaryOp', ['op', 'child']), Operator):
         if op in '+-':
             return eval(op + str(v))
         if op[0] in 'RL':
-            mem = ctx.get_var(child.name)
+            mem = ctx.get_slot(child)
             new_v = eval("{}{}1".format(v, op[1]))
             if isinstance(child, VarRef):
                 mem.put(new_v)
@@ -325,10 +588,44 @@ class UnaryOp(namedtuple('UnaryOp', ['op', 'child']), Operator):
         if op == '!':
             return eval("not {}".format(v))
         if op == '~':
-            C = 2147483648
-            return -(((v + C) % (2*C) - C) + 1)
-
-class BinaryOp(namedtuple('BinaryOp', ['op', 'right', 'left']), Operator):
+            return self.invert(v)
+
+    @staticmethod
+    def invert(v):
+        # bitwise not of v wrapped into a 32 bit int
+        C = 2147483648
+        return -(((v + C) % (2*C) - C) + 1)
+
+    def compile(self):
+        child, op = self.child.compile(), self.op
+        if op == '+':
+            return lambda ctx: +child(ctx)
+        if op == '-':
+            return lambda ctx: -child(ctx)
+        if op == '!':
+            return lambda ctx: not child(ctx)
+        if op == '~':
+            invert = self.invert
+            return lambda ctx: invert(child(ctx))
+        ref, d, post = self.child, 1 if op[1] == '+' else -1, op[0] == 'R'
+        frame, slot, put = ref.frame, ref.slot, Mem.writer()
+        if isinstance(ref, VarRef):
+            def crement(ctx):
+                mem = ctx.frames[frame][slot]
+                v = mem.value
+                put(mem, v + d)
+                return v if post else v + d
+        else:
+            index = ref.index.compile()
+            def crement(ctx):
+                mem, i = ctx.frames[frame][slot], index(ctx)
+                v = mem.value[i]
+                put(mem, v + d, i)
+                return v if post else v + d
+        return crement
+
+class BinaryOp(node('BinaryOp', ['op', 'right', 'left'], ['type']), Operator):
+    __slots__ = ()
     type_map = {
         '+': ['int', 'string'],
         '-': ['int'],
@@ -352,6 +649,20 @@ class BinaryOp(namedtuple('BinaryOp', ['op', 'right', 'left']), Operator):
     }
 
     logic_ops = ['>', '<', '>=', '<=', '!=', '==', '&&', '||']
+
+    funcs = {
+        '+': operator.add,
+        '-': operator.sub,
+        '*': operator.mul,
+        '/': operator.floordiv,
+        '%': operator.mod,
+        '>': operator.gt,
+        '<': operator.lt,
+        '>=': operator.ge,
+        '<=': operator.le,
+        '==': operator.eq,
+        '!=': operator.ne
+    }
     
     def check_type(self):
         l_type, r_type, allowed = self.left.type, self.right.type, self.type_map[self.op]
@@ -370,18 +681,31 @@ class BinaryOp(namedtuple('BinaryOp', ['op', 'right', 'left']), Operator):
         self.check_type()
 
     def evaluate(self, ctx):
-        op, left, right = self.op, self.left.evaluate(ctx), self.right.evaluate(ctx)
-        if op in '+-*/%><' or op in ['>=', '<=', '==', '!=']:
-            if op == '/':
-                op = '//'
-            return eval("{}{}{}".format(left, op, right))
+        op, left = self.op, self.left.evaluate(ctx)
         if op == '&&':
-            return eval("{} and {}".format(left, right))
+            return left and self.right.evaluate(ctx)
         if op == '||':
-            return eval("{} or {}".format(left, right))
+            return left or self.right.evaluate(ctx)
+        right = self.right.evaluate(ctx)
+        if op in self.funcs:
+            return self.funcs[op](left, right)
         raise RuntimeError("Operator {} not supported yet".format(op))
 
-class FuncCall(namedtuple('FuncCall', ['name', 'params']), Typable, Expr):
+    def compile(self):
+        op, left, right = self.op, self.left.compile(), self.right.compile()
+        if op == '&&':
+            return lambda ctx: left(ctx) and right(ctx)
+        if op == '||':
+            return lambda ctx: left(ctx) or right(ctx)
+        if op not in self.funcs:
+            def unsupported(ctx):
+                raise RuntimeError("Operator {} not supported yet".format(op))
+            return unsupported
+        f = self.funcs[op]
+        return lambda ctx: f(left(ctx), right(ctx))
+
+class FuncCall(node('FuncCall', ['name', 'params'], ['type']), Typable, Expr):
+    __slots__ = ()
     
     def validate(self, ctx):
         self.type, v_types = ctx.get_func(self.name)
@@ -397,21 +721,31 @@ class FuncCall(namedtuple('FuncCall', ['name', 'params']), Typable, Expr):
         param_values = [p.evaluate(ctx) for p in self.params]
         return func.evaluate(ctx, param_values)
 
+    def compile(self):
+        name, params = self.name, [p.compile() for p in self.params]
+        return lambda ctx: ctx.get_func(name)([p(ctx) for p in params])
+
 class Reference(Typable, Expr):
-    pass
+    __slots__ = ()
 
-class VarRef(namedtuple('VarRef', ['name']), Reference):
+class VarRef(node('VarRef', ['name'], ['type', 'frame', 'slot']), Reference):
+    __slots__ = ()
 
     def validate(self, ctx):
-        self.type, _ = ctx.get_var(self.name)
+        self.type, _, self.frame, self.slot = ctx.get_var(self.name)
 
     def evaluate(self, ctx):
-        return ctx.get_var(self.name).get()
+        return ctx.get_slot(self).get()
 
-class ArrayRef(namedtuple('ArrayRef', ['name', 'index']), Reference):
+    def compile(self):
+        frame, slot = self.frame, self.slot
+        return lambda ctx: ctx.frames[frame][slot].value
+
+class ArrayRef(node('ArrayRef', ['name', 'index'], ['type', 'frame', 'slot']), Reference):
+    __slots__ = ()
 
     def validate(self, ctx):
-        self.type, is_array = ctx.get_var(self.name)
+        self.type, is_array, self.frame, self.slot = ctx.get_var(self.name)
         if not is_array:
             raise NotAnArrayException(self.name)
         self.index.validate(ctx)
@@ -419,12 +753,17 @@ class ArrayRef(namedtuple('ArrayRef', ['name', 'index']), Reference):
 
     def evaluate(self, ctx):
         i = self.index.evaluate(ctx)
-        return ctx.get_var(self.name).get(i)
+        return ctx.get_slot(self).get(i)
+
+    def compile(self):
+        frame, slot, index = self.frame, self.slot, self.index.compile()
+        return lambda ctx: ctx.frames[frame][slot].value[index(ctx)]
 
-# class Param(namedtuple('Param', ['name', 'expr']), Tree):
+# class Param(node('Param', ['name', 'expr']), Tree):
 #     pass
 
-class Block(namedtuple('Block', ['statements']), Tree):
+class Block(node('Block', ['statements']), Tree):
+    __slots__ = ()
 
     def validate(self, ctx):
         for st in self.statements:
@@ -437,7 +776,36 @@ class Block(namedtuple('Block', ['statements']), Tree):
                 return v
         return None
 
-class Assignment(namedtuple('Assignment', ['ref', 'op', 'expr']), Tree):
+    def defines_functions(self):
+        return any(isinstance(st, FuncDef) for st in self.statements)
+
+    def evaluate_scope(self, ctx):
+        if self.defines_functions():
+            ctx = Context.new(None, ctx)
+        return self.evaluate(ctx)
+
+    def compile_scope(self):
+        # Variables live in the function's frame, so a block only needs its
+        # own context when nested functions get registered in it
+        run = self.compile_statement()
+        if not self.defines_functions():
+            return run
+        return lambda ctx: run(Context.new(None, ctx))
+
+    def compile_statement(self):
+        statements = [st.compile_statement() for st in self.statements]
+        if len(statements) == 1:
+            return statements[0]
+        def run(ctx):
+            for st in statements:
+                v = st(ctx)
+                if v is not NEXT:
+                    return v
+            return NEXT
+        return run
+
+class Assignment(node('Assignment', ['ref', 'op', 'expr']), Tree):
+    __slots__ = ()
 
     def validate(self, ctx):
         self.ref.validate(ctx)
@@ -448,7 +816,7 @@ class Assignment(namedtuple('Assignment', ['ref', 'op', 'expr']), Tree):
         ref, op, expr = self.ref, self.op, self.expr
         if isinstance(expr, Expr):
             expr = expr.evaluate(ctx)
-        mem = ctx.get_var(ref.name)
+        mem = ctx.get_slot(ref)
         if isinstance(ref, VarRef):
             if op == '=':
                 mem.put(expr)
@@ -465,7 +833,38 @@ class Assignment(namedtuple('Assignment', ['ref', 'op', 'expr']), Tree):
                 code = "{}{}{}".format(original_value, op[0], expr)
                 mem.put(eval(code), i)
 
-class Return(namedtuple('Return', ['expr']), Tree):
+    def compile_statement(self):
+        ref, op, expr = self.ref, self.op, self.expr.compile()
+        frame, slot, put = ref.frame, ref.slot, Mem.writer()
+        f = None if op == '=' else BinaryOp.funcs[op[0]]
+        if isinstance(ref, VarRef):
+            if f is None:
+                def run(ctx):
+                    put(ctx.frames[frame][slot], expr(ctx))
+                    return NEXT
+            else:
+                def run(ctx):
+                    v = expr(ctx)
+                    mem = ctx.frames[frame][slot]
+                    put(mem, f(mem.value, v))
+                    return NEXT
+        else:
+            index = ref.index.compile()
+            if f is None:
+                def run(ctx):
+                    v = expr(ctx)
+                    put(ctx.frames[frame][slot], v, index(ctx))
+                    return NEXT
+            else:
+                def run(ctx):
+                    v = expr(ctx)
+                    mem, i = ctx.frames[frame][slot], index(ctx)
+                    put(mem, f(mem.value[i], v), i)
+                    return NEXT
+        return run
+
+class Return(node('Return', ['expr']), Tree):
+    __slots__ = ()
 
     def validate(self, ctx):
         target_ctx = ctx.get_return_target()
@@ -479,7 +878,13 @@ class Return(namedtuple('Return', ['expr']), Tree):
     def evaluate(self, ctx):
         return ReturnValue(self.expr.evaluate(ctx))
 
-class If(namedtuple('If', ['cond', 'true_body', 'false_body']), Tree):
+    def compile_statement(self):
+        if self.expr == None:
+            return lambda ctx: None
+        return self.expr.compile()
+
+class If(node('If', ['cond', 'true_body', 'false_body']), Tree):
+    __slots__ = ()
     
     def validate(self, ctx):
         cond = self.cond
@@ -491,11 +896,27 @@ class If(namedtuple('If', ['cond', 'true_body', 'false_body']), Tree):
 
     def evaluate(self, ctx):
         if self.cond.evaluate(ctx):
-            return self.true_body.evaluate(Context.new(None, ctx))
+            return self.true_body.evaluate_scope(ctx)
         if self.false_body != None:
-            return self.false_body.evaluate(Context.new(None, ctx))
-
-class While(namedtuple('While', ['cond', 'body']), Tree):
+            return self.false_body.evaluate_scope(ctx)
+
+    def compile_statement(self):
+        cond, true_body = self.cond.compile(), self.true_body.compile_scope()
+        if self.false_body == None:
+            def run(ctx):
+                if cond(ctx):
+                    return true_body(ctx)
+                return NEXT
+        else:
+            false_body = self.false_body.compile_scope()
+            def run(ctx):
+                if cond(ctx):
+                    return true_body(ctx)
+                return false_body(ctx)
+        return run
+
+class While(node('While', ['cond', 'body']), Tree):
+    __slots__ = ()
     
     def validate(self, ctx):
         cond = self.cond
@@ -504,8 +925,20 @@ class While(namedtuple('While', ['cond', 'body']), Tree):
         self.body.validate(Context.new(None, ctx))
 
     def evaluate(self, ctx):
-        new_ctx = Context.new(None, ctx)
+        new_ctx = Context.new(None, ctx) if self.body.defines_functions() else ctx
         while self.cond.evaluate(new_ctx):
             rtn = self.body.evaluate(new_ctx)
             if isinstance(rtn, ReturnValue):
                 return rtn
+
+    def compile_statement(self):
+        cond, body = self.cond.compile(), self.body.compile_statement()
+        scoped = self.body.defines_functions()
+        def run(ctx):
+            new_ctx = Context.new(None, ctx) if scoped else ctx
+            while cond(new_ctx):
+                v = body(new_ctx)
+                if v is not NEXT:
+                    return v
+            return NEXT
+        return run
@@ -0,0 +1,403 @@
+import marshal
+import operator
+
+from array import array
+from tree import *
+from optimizer import is_pure
+from runtime import *
+from exceptions import *
+
+# Every instruction is two ints in the code array: opcode and argument.
+# Jump arguments are absolute offsets into the code array.
+OPCODES = [
+    'LOAD',            # push locals[arg]
+    'STORE',           # pop into locals[arg]
+    'CONST',           # push consts[arg]
+    'BINARY',          # pop b, a; push binary_funcs[arg](a, b)
+    'JUMP_IF_FALSE',   # pop; jump to arg if false
+    'JUMP',            # jump to arg
+    'LOAD_ELEM',       # pop index; push locals[arg][index]
+    'STORE_ELEM',      # pop value, index; locals[arg][index] = value
+    'CREMENT',         # ++/-- on locals[arg >> 2], see crement_arg
+    'CREMENT_ELEM',    # same on an element, index popped
+    'POP',
+    'DUP',
+    'JUMP_IF_FALSE_OR_POP',
+    'JUMP_IF_TRUE_OR_POP',
+    'UNARY',           # replace top with unary_funcs[arg](top)
+    'CALL',            # call functions[arg], popping its arguments
+    'RETURN',
+    'NEW_ARRAY',       # pop size, nil; push [nil] * size
+    'BUILD_ARRAY',     # pop arg values into a list
+    'PRINTF',          # pop arg values and a format string
+    'TAILCALL',        # like CALL + RETURN, reusing the current frame
+]
+for i, name in enumerate(OPCODES):
+    globals()[name] = i
+
+def unsupported(op):
+    def f(a, b):
+        raise RuntimeError("Operator {} not supported yet".format(op))
+    return f
+
+binary_ops = list(BinaryOp.funcs) + ['<<', '>>', '&', '^', '|']
+binary_funcs = [BinaryOp.funcs.get(op) or unsupported(op) for op in binary_ops]
+unary_ops = ['+', '-', '!', '~']
+unary_funcs = [operator.pos, operator.neg, operator.not_, UnaryOp.invert]
+
+def crement_arg(slot, op):
+    # slot, whether it's ++ and whether the old value is kept
+    return slot << 2 | (op[1] == '+') << 1 | (op[0] == 'R')
+
+class Function:
+
+    def __init__(self, name, nargs):
+        self.name = name
+        self.nargs = nargs
+        self.nlocals = nargs
+        self.code = array('i')
+        self.consts = []
+        self.const_index = {}
+        self.varnames = []
+        self.temp = None
+
+    def const(self, v):
+        # 1 == True, so constants are told apart by type too
+        key = (type(v), v)
+        if key not in self.const_index:
+            self.const_index[key] = len(self.consts)
+            self.consts.append(v)
+        return self.const_index[key]
+
+class Program:
+
+    def __init__(self, functions):
+        self.functions = functions
+        self.index = {f.name: i for i, f in enumerate(functions)}
+
+    def dumps(self):
+        return marshal.dumps([(f.name, f.nargs, f.nlocals, f.code.tobytes(),
+            f.consts, f.varnames) for f in self.functions])
+
+    @classmethod
+    def loads(cls, data):
+        functions = []
+        for name, nargs, nlocals, code, consts, varnames in marshal.loads(data):
+            f = Function(name, nargs)
+            f.nlocals, f.consts, f.varnames = nlocals, consts, varnames
+            f.code.frombytes(code)
+            functions.append(f)
+        return cls(functions)
+
+class BytecodeCompiler:
+    """ Lower a validated Root into a Program of flat bytecode functions """
+
+    def compile(self, root):
+        self.index = {f.name: i for i, f in enumerate(root.functions)}
+        return Program([self.compile_func(f) for f in root.functions])
+
+    def compile_func(self, f):
+        # locals are the slots validate gave each variable
+        self.func = Function(f.name, len(f.args))
+        self.func.nlocals = f.n_slots
+        self.func.varnames = [None] * f.n_slots
+        for arg in f.args:
+            self.declare(arg)
+        self.block(f.body)
+        self.emit(CONST, self.func.const(None))
+        self.emit(RETURN)
+        return self.func
+
+    def emit(self, op, arg=0):
+        self.func.code.extend((op, arg))
+        return len(self.func.code) - 1
+
+    def label(self):
+        return len(self.func.code)
+
+    def patch(self, at, target):
+        self.func.code[at] = target
+
+    def declare(self, v):
+        self.func.varnames[v.slot] = v.name
+        return v.slot
+
+    def temp(self):
+        # one extra local per function, for values kept across an expression
+        if self.func.temp is None:
+            self.func.temp = self.func.nlocals
+            self.func.nlocals += 1
+            self.func.varnames.append(None)
+        return self.func.temp
+
+    # statements
+
+    def block(self, block):
+        for st in block.statements:
+            self.statement(st)
+
+    def statement(self, st):
+        method = getattr(self, 'st_' + type(st).__name__, None)
+        if method is None:
+            self.expr(st)
+            self.emit(POP)
+        else:
+            method(st)
+
+    def st_Block(self, st):
+        self.block(st)
+
+    def st_FuncDef(self, st):
+        raise CodeGenException(
+            "Nested function {} is not supported by the bytecode backend".format(st.name))
+
+    def st_VarDef(self, v):
+        _len, default = v.len, v.default
+        if default != None:
+            self.expr(default)
+        elif _len is None:
+            self.emit(CONST, self.func.const(VarDef.nil[v.type]))
+        else:
+            self.emit(CONST, self.func.const(VarDef.nil[v.type]))
+            if isinstance(_len, Tree):
+                self.expr(_len)
+            else:
+                self.emit(CONST, self.func.const(_len))
+            self.emit(NEW_ARRAY)
+        self.emit(STORE, self.declare(v))
+
+    def st_Assignment(self, a):
+        ref, op = a.ref, a.op
+        slot = ref.slot
+        if isinstance(ref, VarRef):
+            if op != '=':
+                self.emit(LOAD, slot)
+            self.expr(a.expr)
+        elif is_pure(ref.index) and is_pure(a.expr):
+            self.expr(ref.index)
+            if op != '=':
+                self.emit(DUP)
+                self.emit(LOAD_ELEM, slot)
+            self.expr(a.expr)
+        else:
+            # the value is computed before the index, like the other
+            # backends, and kept aside until the index is on the stack
+            self.expr(a.expr)
+            self.emit(STORE, self.temp())
+            self.expr(ref.index)
+            if op != '=':
+                self.emit(DUP)
+                self.emit(LOAD_ELEM, slot)
+            self.emit(LOAD, self.temp())
+        if op != '=':
+            self.emit(BINARY, binary_ops.index(op[0]))
+        self.emit(STORE if isinstance(ref, VarRef) else STORE_ELEM, slot)
+
+    def st_Return(self, r):
+        if r.expr == None:
+            self.emit(CONST, self.func.const(None))
+        elif isinstance(r.expr, FuncCall):
+            for p in r.expr.params:
+                self.expr(p)
+            self.emit(TAILCALL, self.index[r.expr.name])
+            return
+        else:
+            self.expr(r.expr)
+        self.emit(RETURN)
+
+    def st_If(self, st):
+        self.expr(st.cond)
+        to_else = self.emit(JUMP_IF_FALSE)
+        self.block(st.true_body)
+        if st.false_body != None:
+            to_end = self.emit(JUMP)
+            self.patch(to_else, self.label())
+            self.block(st.false_body)
+            self.patch(to_end, self.label())
+        else:
+            self.patch(to_else, self.label())
+
+    def st_While(self, st):
+        start = self.label()
+        self.expr(st.cond)
+        to_end = self.emit(JUMP_IF_FALSE)
+        self.block(st.body)
+        self.emit(JUMP, start)
+        self.patch(to_end, self.label())
+
+    def st_Printf(self, p):
+        self.expr(p.format)
+        for v in p.params:
+            self.expr(v)
+        self.emit(PRINTF, len(p.params))
+
+    # expressions
+
+    def expr(self, e):
+        if isinstance(e, Literal):
+            self.emit(CONST, self.func.const(e.value))
+        elif isinstance(e, VarRef):
+            self.emit(LOAD, e.slot)
+        elif isinstance(e, ArrayRef):
+            self.expr(e.index)
+            self.emit(LOAD_ELEM, e.slot)
+        elif isinstance(e, FuncCall):
+            for p in e.params:
+                self.expr(p)
+            self.emit(CALL, self.index[e.name])
+        elif isinstance(e, ArrayInit):
+            for v in e.value:
+                self.expr(v)
+            self.emit(BUILD_ARRAY, len(e.value))
+        elif isinstance(e, BinaryOp):
+            self.binary(e)
+        elif isinstance(e, UnaryOp):
+            self.unary(e)
+        else:
+            raise CodeGenException("Unexpected expression {}".format(type(e).__name__))
+
+    def binary(self, e):
+        self.expr(e.left)
+        if e.op in ['&&', '||']:
+            jump = self.emit(JUMP_IF_FALSE_OR_POP if e.op == '&&' else JUMP_IF_TRUE_OR_POP)
+            self.expr(e.right)
+            self.patch(jump, self.label())
+        else:
+            self.expr(e.right)
+            self.emit(BINARY, binary_ops.index(e.op))
+
+    def unary(self, e):
+        op, child = e.op, e.child
+        if op in unary_ops:
+            self.expr(child)
+            self.emit(UNARY, unary_ops.index(op))
+        elif isinstance(child, ArrayRef):
+            self.expr(child.index)
+            self.emit(CREMENT_ELEM, crement_arg(child.slot, op))
+        else:
+            self.emit(CREMENT, crement_arg(child.slot, op))
+
+class VM:
+
+    def __init__(self, program):
+        self.program = program
+
+    def run(self):
+        index = self.program.index
+        if 'main' not in index:
+            return None
+        return self.call(self.program.functions[index['main']], [])
+
+    def call(self, func, args):
+        # C calls don't recurse in python: the caller's frame is pushed on
+        # frames and the callee runs in the same loop, so recursion depth
+        # is only bounded by memory
+        functions = self.program.functions
+        code, consts = func.code, func.consts
+        local = args + [None] * (func.nlocals - func.nargs)
+        stack, frames = [], []
+        push, pop = stack.append, stack.pop
+        pc = 0
+        while True:
+            op, arg = code[pc], code[pc + 1]
+            pc += 2
+            if op == LOAD:
+                push(local[arg])
+            elif op == CONST:
+                push(consts[arg])
+            elif op == BINARY:
+                b = pop()
+                stack[-1] = binary_funcs[arg](stack[-1], b)
+            elif op == STORE:
+                local[arg] = pop()
+            elif op == JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == LOAD_ELEM:
+                stack[-1] = local[arg][stack[-1]]
+            elif op == STORE_ELEM:
+                v = pop()
+                local[arg][pop()] = v
+            elif op == CREMENT:
+                slot, d = arg >> 2, 1 if arg & 2 else -1
+                v = local[slot]
+                local[slot] = v + d
+                push(v if arg & 1 else v + d)
+            elif op == POP:
+                pop()
+            elif op == CALL or op == TAILCALL:
+                f = functions[arg]
+                n = len(stack) - f.nargs
+                args = stack[n:]
+                del stack[n:]
+                if op == CALL:
+                    frames.append((code, consts, local, pc))
+                code, consts, pc = f.code, f.consts, 0
+                local = args + [None] * (f.nlocals - f.nargs)
+            elif op == RETURN:
+                if not frames:
+                    return pop()
+                code, consts, local, pc = frames.pop()
+            elif op == CREMENT_ELEM:
+                a, i, d = local[arg >> 2], pop(), 1 if arg & 2 else -1
+                v = a[i]
+                a[i] = v + d
+                push(v if arg & 1 else v + d)
+            elif op == UNARY:
+                stack[-1] = unary_funcs[arg](stack[-1])
+            elif op == JUMP_IF_FALSE_OR_POP:
+                if stack[-1]:
+                    pop()
+                else:
+                    pc = arg
+            elif op == JUMP_IF_TRUE_OR_POP:
+                if stack[-1]:
+                    pc = arg
+                else:
+                    pop()
+            elif op == DUP:
+                push(stack[-1])
+            elif op == NEW_ARRAY:
+                size = pop()
+                stack[-1] = [stack[-1]] * size
+            elif op == BUILD_ARRAY:
+                values = stack[len(stack) - arg:]
+                del stack[len(stack) - arg:]
+                push(values)
+            elif op == PRINTF:
+                values = tuple(stack[len(stack) - arg:])
+                del stack[len(stack) - arg:]
+                print(pop() % values, end='')
+            else:
+                raise RuntimeError("Unknown opcode {}".format(op))
+
+def disassemble(program):
+    lines = []
+    for f in program.functions:
+        lines.append("{}({} args, {} locals):".format(f.name, f.nargs, f.nlocals))
+        code = f.code
+        for pc in range(0, len(code), 2):
+            op, arg = code[pc], code[pc + 1]
+            name = OPCODES[op]
+            if name in ['LOAD', 'STORE', 'LOAD_ELEM', 'STORE_ELEM']:
+                detail = f.varnames[arg]
+            elif name == 'CONST':
+                detail = repr(f.consts[arg])
+            elif name == 'BINARY':
+                detail = binary_ops[arg]
+            elif name == 'UNARY':
+                detail = unary_ops[arg]
+            elif name in ['CREMENT', 'CREMENT_ELEM']:
+                detail = '{}{}'.format('R' if arg & 1 else 'L', '++' if arg & 2 else '--')
+                detail += ' ' + f.varnames[arg >> 2]
+            elif name in ['CALL', 'TAILCALL']:
+                detail = program.functions[arg].name
+            elif name.startswith('JUMP'):
+                detail = '-> {}'.format(arg)
+            else:
+                detail = ''
+            lines.append("{:>6} {:<22}{:>5}  {}".format(pc, name, arg, detail).rstrip())
+        lines.append('')
+    return '\n'.join(lines)
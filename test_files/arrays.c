@@ -0,0 +1,20 @@
+int main() {
+    char s[] = {'h', 'i', '!'};
+    bool b[4];
+    int n = 5;
+    int a[n];
+    b[2] = true;
+    a[4] = 99999999999;
+    s[1] = 'o';
+    int i = 0;
+    while (i < 3) {
+        printf("%c", s[i]);
+        i++;
+    }
+    if (b[2] && !b[1]) {
+        printf(" %d\n", a[4] + a[0]);
+    }
+    char t[3];
+    printf("[%c]", t[0]);
+    return 0;
+}
@@ -0,0 +1,17 @@
+// the value of an assignment is computed before the array index
+int g(int x) {
+    printf("g%d;", x);
+    return x;
+}
+
+int main() {
+    int a[4];
+    int unused[4];
+    a[g(1)] = g(2);
+    a[g(3)] += g(1);
+    unused[g(2)] = g(3);
+    int i = 0;
+    a[i] = i++;
+    printf("\n");
+    return a[0] * 100 + a[1] * 10 + a[3];
+}